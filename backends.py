@@ -0,0 +1,200 @@
+#!/usr/bin/python3
+
+import os
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class FanBackend:
+    # A fan output: setup() claims the pin and starts PWM at a duty cycle,
+    # set_duty() changes it, stop() halts PWM and cleanup() releases the pin
+    def setup(self, duty=0):
+        raise NotImplementedError
+
+    def set_duty(self, duty):
+        raise NotImplementedError
+
+    def stop(self):
+        raise NotImplementedError
+
+    def cleanup(self):
+        raise NotImplementedError
+
+
+class RPiGPIOBackend(FanBackend):
+    # Software PWM through RPi.GPIO on a BCM pin
+    def __init__(self, pin=14, frequency=100):
+        self.pin = pin
+        self.frequency = frequency
+        self.pwm = None
+
+    def setup(self, duty=0):
+        import RPi.GPIO as GPIO
+        self.GPIO = GPIO
+
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setwarnings(False)
+        GPIO.setup(self.pin, GPIO.OUT)
+        self.pwm = GPIO.PWM(self.pin, self.frequency)
+        self.pwm.start(duty)
+
+    def set_duty(self, duty):
+        self.pwm.ChangeDutyCycle(duty)
+
+    def stop(self):
+        self.pwm.stop()
+
+    def cleanup(self):
+        # Drive the pin low so the fan stays off once PWM is released
+        GPIO = self.GPIO
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setup(self.pin, GPIO.OUT)
+        GPIO.output(self.pin, GPIO.LOW)
+        GPIO.cleanup()
+
+
+class SysfsPWMBackend(FanBackend):
+    # Hardware PWM through /sys/class/pwm (needs the pwm dtoverlay on the Pi)
+    def __init__(self, chip=0, channel=0, frequency=25000, root="/"):
+        self.chip_dir = os.path.join(root, f"sys/class/pwm/pwmchip{chip}")
+        self.channel = channel
+        self.channel_dir = os.path.join(self.chip_dir, f"pwm{channel}")
+        self.period = int(1e9 / frequency)
+        self.duty_fd = None
+
+    def write(self, name, value):
+        with open(os.path.join(self.channel_dir, name), "w") as f:
+            f.write(str(value))
+
+    def setup(self, duty=0):
+        if not os.path.isdir(self.channel_dir):
+            with open(os.path.join(self.chip_dir, "export"), "w") as f:
+                f.write(str(self.channel))
+        # The kernel rejects a period shorter than the duty cycle already
+        # set (EINVAL), say one left by an earlier run at another frequency,
+        # so clear the duty before changing the period
+        self.duty_fd = os.open(os.path.join(self.channel_dir, "duty_cycle"), os.O_WRONLY)
+        os.pwrite(self.duty_fd, b"0", 0)
+        self.write("period", self.period)
+        self.set_duty(duty)
+        self.write("enable", 1)
+
+    def set_duty(self, duty):
+        os.pwrite(self.duty_fd, str(int(self.period * duty / 100)).encode(), 0)
+
+    def stop(self):
+        self.write("enable", 0)
+
+    def cleanup(self):
+        if self.duty_fd is not None:
+            os.close(self.duty_fd)
+            self.duty_fd = None
+        with open(os.path.join(self.chip_dir, "unexport"), "w") as f:
+            f.write(str(self.channel))
+
+
+class SimulatedBackend(FanBackend):
+    # In-process fan that records every duty-cycle write as (time, duty)
+    def __init__(self, clock=None):
+        self.now = clock.now if clock is not None else time.monotonic
+        self.writes = []
+        self.duty = 0
+        self.running = False
+
+    def setup(self, duty=0):
+        self.running = True
+        self.set_duty(duty)
+
+    def set_duty(self, duty):
+        self.duty = duty
+        self.writes.append((self.now(), duty))
+
+    def stop(self):
+        self.running = False
+
+    def cleanup(self):
+        self.running = False
+
+    def redundant_writes(self):
+        # Writes that repeated the duty cycle already in effect
+        return sum(1 for (_, a), (_, b) in zip(self.writes, self.writes[1:]) if a == b)
+
+
+class OutputStage(FanBackend):
+    # Sits between the controller and a backend and keeps PWM writes to
+    # the ones that change something. Every duty is rounded to `resolution`
+    # % and a write of the duty already in effect is dropped. step() moves
+    # toward a target by at most `slew_rate` × `dwell` % per write, at
+    # most once every `dwell` seconds (either at 0 jumps straight there).
+    # `issued` and `suppressed` count the writes passed on and dropped.
+    def __init__(self, backend, resolution=1.0, slew_rate=5.0, dwell=1.0):
+        self.backend = backend
+        self.resolution = resolution
+        self.slew_rate = slew_rate
+        self.dwell = dwell
+        self.duty = None
+        self.last_step = None
+        self.requested = None
+        self.issued = 0
+        self.suppressed = 0
+
+    def quantize(self, duty):
+        if self.resolution:
+            duty = round(duty / self.resolution) * self.resolution
+        return min(max(duty, 0.0), 100.0)
+
+    def setup(self, duty=0):
+        self.duty = self.quantize(duty)
+        self.backend.setup(self.duty)
+        self.issued += 1
+
+    def set_duty(self, duty):
+        duty = self.quantize(duty)
+        if duty == self.duty:
+            self.suppressed += 1
+            return
+        self.duty = duty
+        self.backend.set_duty(duty)
+        self.issued += 1
+
+    def step(self, target, now):
+        # One slew-limited write toward `target` if the dwell since the last
+        # step has passed. Returns when to step next, or None at the target.
+        requested, target = target, self.quantize(target)
+        current = self.duty or 0.0
+        if current == target:
+            if requested != self.requested:
+                self.suppressed += 1  # a new target that rounds to the duty held
+            self.requested = requested
+            return None
+        self.requested = requested
+        if self.last_step is not None and now < self.last_step + self.dwell:
+            return self.last_step + self.dwell
+        limit = self.slew_rate * self.dwell
+        if limit and abs(target - current) > limit:
+            duty = self.quantize(current + limit if target > current else current - limit)
+            if duty == current:
+                duty = current + (self.resolution if target > current else -self.resolution)
+        else:
+            duty = target
+        self.set_duty(duty)
+        self.last_step = now
+        return None if duty == target else now + self.dwell
+
+    def stop(self):
+        self.backend.stop()
+
+    def cleanup(self):
+        self.backend.cleanup()
+
+
+def create_backend(name, pin=14, frequency=100, clock=None, chip=0, channel=0):
+    if name == "gpio":
+        return RPiGPIOBackend(pin, frequency)
+    if name == "sysfs":
+        return SysfsPWMBackend(chip, channel, frequency)
+    if name == "sim":
+        return SimulatedBackend(clock)
+    raise ValueError(f"Unknown fan backend: {name}")
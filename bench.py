@@ -0,0 +1,1205 @@
+#!/usr/bin/python3
+
+# Micro-benchmarks for the fan control scripts. Run without hardware:
+#   python3 bench.py sensors
+#   python3 bench.py writes --hours 1 --speed 1000
+#   python3 bench.py latency --interval 0.25
+#   python3 bench.py curve --samples 86400
+#   python3 bench.py pid --hours 4
+#   python3 bench.py telemetry --samples 100000
+#   python3 bench.py gui --seconds 20    (needs a display; xvfb-run will do)
+#   python3 bench.py ipc --clients 100
+#   python3 bench.py channels --channels 1 4 16 64
+#   python3 bench.py tach --rate 1000 10000 50000
+#   python3 bench.py predict --hours 4 [--trace fan_telemetry.bin]
+#   python3 bench.py output --hours 4
+#   python3 bench.py startup --runs 5
+#   python3 bench.py metrics --channels 4 --scrapes 200
+#   python3 bench.py replay --sets 1 10 100 --hours 1
+#   python3 bench.py throttle --hours 4 --ambient 25 35
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import argparse
+import configparser
+import logging
+import io
+import asyncio
+import contextlib
+import json
+import random
+import threading
+import subprocess
+
+from sensors import CPUSensors
+from backends import SimulatedBackend
+from clock import SimulatedClock, SimulatedEventLoop
+
+
+def make_fake_sysfs(root, temp=45.0, freq=1500000000):
+    # Lay out the parts of /sys that CPUSensors reads
+    zone = os.path.join(root, "sys/class/thermal/thermal_zone0")
+    os.makedirs(zone, exist_ok=True)
+    with open(os.path.join(zone, "type"), "w") as f:
+        f.write("cpu-thermal\n")
+    with open(os.path.join(zone, "temp"), "w") as f:
+        f.write(f"{int(temp * 1000)}\n")
+
+    cpufreq = os.path.join(root, "sys/devices/system/cpu/cpu0/cpufreq")
+    os.makedirs(cpufreq, exist_ok=True)
+    with open(os.path.join(cpufreq, "scaling_cur_freq"), "w") as f:
+        f.write(f"{freq // 1000}\n")
+    return root
+
+
+def per_sample(fn, samples):
+    start = time.perf_counter()
+    for _ in range(samples):
+        fn()
+    return (time.perf_counter() - start) / samples
+
+
+def bench_sensors(args):
+    root = make_fake_sysfs(tempfile.mkdtemp())
+    try:
+        sensors = CPUSensors(root=root)
+        sysfs = per_sample(lambda: (sensors.temperature(), sensors.frequency()), args.samples)
+        sensors.close()
+
+        # The legacy path forks a shell pipeline per value. Without vcgencmd on
+        # this machine, time the same process shape against the fake tree.
+        if shutil.which("vcgencmd"):
+            temp_cmd = "vcgencmd measure_temp | sed 's/[^0-9.]//g'"
+            freq_cmd = "vcgencmd measure_clock arm | awk -F '=' '{print $2}'"
+        else:
+            temp_cmd = f"cat {root}/sys/class/thermal/thermal_zone0/temp | sed 's/[^0-9.]//g'"
+            freq_cmd = f"cat {root}/sys/devices/system/cpu/cpu0/cpufreq/scaling_cur_freq | awk '{{print $1}}'"
+        fork = per_sample(lambda: (subprocess.getoutput(temp_cmd), subprocess.getoutput(freq_cmd)),
+                          max(1, args.samples // 100))
+    finally:
+        shutil.rmtree(root)
+
+    print(f"sysfs pread:   {sysfs * 1e6:10.2f} us/sample")
+    print(f"fork pipeline: {fork * 1e6:10.2f} us/sample")
+    print(f"speedup:       {fork / sysfs:10.1f}x")
+
+
+class SweepSensors:
+    # Temperature that sweeps 30-55 °C and back once an hour of clock time
+    def __init__(self, clock, low=30.0, high=55.0, period=3600.0):
+        self.clock = clock
+        self.low = low
+        self.high = high
+        self.period = period
+
+    def temperature(self):
+        phase = (self.clock.now() % self.period) / self.period
+        return self.low + (self.high - self.low) * (1 - abs(2 * phase - 1))
+
+    def frequency(self):
+        return 1500000000
+
+
+class StepSensors:
+    # Temperature that jumps from `before` to `after` at clock time `at`
+    def __init__(self, clock, at, before=35.0, after=50.0):
+        self.clock = clock
+        self.at = at
+        self.before = before
+        self.after = after
+
+    def temperature(self):
+        return self.after if self.clock.now() >= self.at else self.before
+
+    def frequency(self):
+        return 1500000000
+
+
+def run_simulated(clock, coro, duration):
+    # Run a coroutine on simulated time for `duration` clock seconds, quietly
+    loop = SimulatedEventLoop(clock)
+    logging.disable(logging.INFO)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            loop.run_until_complete(asyncio.wait_for(coro, duration))
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        logging.disable(logging.NOTSET)
+        loop.close()
+
+
+def bench_writes(args):
+    import daemon
+
+    clock = SimulatedClock(speed=args.speed)
+    fan = SimulatedBackend(clock)
+    fan.setup(0)
+
+    async def session():
+        controller = daemon.FanController(fan, SweepSensors(clock), lambda: 50.0,
+                                          sample_interval=args.interval)
+        await controller.run()
+
+    start = time.perf_counter()
+    run_simulated(clock, session(), args.hours * 3600)
+    elapsed = time.perf_counter() - start
+
+    writes = len(fan.writes)
+    redundant = fan.redundant_writes()
+    print(f"simulated:       {clock.now() / 3600:10.2f} h in {elapsed:.2f} s real")
+    print(f"duty writes:     {writes / args.hours:10.1f} /h")
+    print(f"redundant:       {redundant / args.hours:10.1f} /h ({100 * redundant / max(writes, 1):.1f}%)")
+
+
+def bench_latency(args):
+    # Time from the temperature crossing a ladder threshold to the first
+    # write of a new duty cycle, and to reaching the new target
+    import daemon
+
+    print(f"{'interval s':>10} {'first write s':>14} {'at target s':>12}")
+    for interval in args.interval:
+        clock = SimulatedClock()
+        fan = SimulatedBackend(clock)
+        fan.setup(0)
+        crossing = 600.0 + interval / 3
+        controller = daemon.FanController(fan, StepSensors(clock, crossing), sample_interval=interval)
+        run_simulated(clock, controller.run(), crossing + 120.0)
+
+        after = [(t, dc) for t, dc in fan.writes if t >= crossing]
+        target = controller.policy(temp=50.0)
+        reached = next(t for t, dc in after if dc == target)
+        print(f"{interval:10.3f} {after[0][0] - crossing:14.3f} {reached - crossing:12.3f}")
+
+
+def bench_curve(args):
+    # Replay a day of 1 Hz telemetry through the default fan policy
+    import fancurve
+
+    rng = random.Random(1)
+    temps, temp = [], 40.0
+    for _ in range(args.samples):
+        temp = min(max(temp + rng.gauss(0, 0.3), 25.0), 80.0)
+        temps.append(temp)
+    loads = [rng.uniform(0, 100) for _ in range(args.samples)]
+    policy = fancurve.default_policy()
+    fancurve.numpy()  # import numpy outside the timing
+
+    start = time.perf_counter()
+    policy.evaluate(temp=temps, load=loads)
+    batch = time.perf_counter() - start
+
+    start = time.perf_counter()
+    policy.curves["temp"].replay(temps)
+    replay = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for t, l in zip(temps, loads):
+        policy(temp=t, load=l)
+    tick = (time.perf_counter() - start) / args.samples
+
+    print(f"numpy:           {'yes' if fancurve.numpy() is not None else 'no'}")
+    print(f"batch evaluate:  {batch * 1e3:10.2f} ms for {args.samples} samples")
+    print(f"replay:          {replay * 1e3:10.2f} ms for {args.samples} samples")
+    print(f"per tick:        {tick * 1e6:10.2f} us")
+
+
+def busy_idle(period=1200.0, busy=100.0, idle=5.0):
+    # Load profile: busy for the first half of every period, idle after
+    return lambda t: busy if t % period < period / 2 else idle
+
+
+def open_loop_trace(seconds=3600.0, load=50.0):
+    # Step the fan between duty levels at constant load and record the trace
+    # the auto-tuner fits
+    from thermal import ThermalModel
+
+    model = ThermalModel()
+    model.step(3600.0, load, 50.0)
+    times, temps, duties = [], [], []
+    levels = [50, 80, 30, 100, 0, 60]
+    for t in range(int(seconds)):
+        duty = levels[int(t // (seconds / len(levels)))]
+        times.append(float(t))
+        temps.append(round(model.soc_temp, 1))
+        duties.append(float(duty))
+        model.step(1.0, load, duty)
+    return times, temps, duties
+
+
+def simulate_policy(policy, hours, load, model=None, output=None):
+    # Run FanController with `policy` against the thermal model and return
+    # the fan writes and the temperature trace sampled once a second.
+    # `output` makes the OutputStage for the fan backend.
+    import daemon
+    from channels import FanChannel
+    from thermal import ThermalModel, SimulatedSensors
+
+    clock = SimulatedClock()
+    fan = SimulatedBackend(clock)
+    fan.setup(0)
+    sensors = SimulatedSensors(model or ThermalModel(), fan, clock, load)
+    if hasattr(policy, "now"):
+        policy.now = clock.now
+    channel = FanChannel("fan", fan, sensors, policy, output=output(fan) if output else None)
+    controller = daemon.FanController(sensors=sensors, load=sensors.load, channels=[channel])
+
+    temps = []
+
+    async def record():
+        while True:
+            temps.append(sensors.temperature())
+            await asyncio.sleep(1.0)
+
+    async def session():
+        await asyncio.gather(controller.run(), record())
+
+    run_simulated(clock, session(), hours * 3600)
+    return fan.writes, temps
+
+
+def mean_duty(writes, end):
+    # Time-weighted mean of a (time, duty) write log up to `end`
+    total = 0.0
+    for (t0, dc), (t1, _) in zip(writes, writes[1:] + [(end, None)]):
+        total += dc * (t1 - t0)
+    return total / (end - writes[0][0])
+
+
+def pid_flat_reading(target, seconds=600.0):
+    # The PID against a reading that holds still: `seconds` at 5 °C under
+    # the target, then 10 °C over it for as long again, without a load
+    # input. Returns the fan writes after the step.
+    import daemon
+    import pid
+
+    clock = SimulatedClock()
+    fan = SimulatedBackend(clock)
+    fan.setup(0)
+    policy = pid.load_pid(configparser.ConfigParser(), now=clock.now)
+    policy.target = target
+    controller = daemon.FanController(fan, StepSensors(clock, seconds, target - 5, target + 10), policy=policy)
+    run_simulated(clock, controller.run(), 2 * seconds)
+    return [(t, dc) for t, dc in fan.writes if t >= seconds]
+
+
+def bench_pid(args):
+    import fancurve
+    import pid
+
+    # Nothing changes while the reading is flat, but the error stays; the
+    # integral has to keep pushing the fan up until it is at full speed
+    writes = pid_flat_reading(args.target)
+    duties = [dc for _, dc in writes]
+    assert duties and duties == sorted(duties) and duties[-1] == 100, \
+        f"PID left the fan at {duties[-1] if duties else 0}% with the reading held 10 °C over target"
+    print(f"flat reading 10 °C over target: 100% after {writes[-1][0] - writes[0][0]:.0f} s")
+
+    times, temps, duties = open_loop_trace()
+    gains = pid.tune(times, temps, duties)
+    print(f"fitted model: {gains['gain']:.3f} °C/% duty, tau {gains['tau']:.0f} s, delay {gains['delay']:.0f} s")
+    print(f"tuned gains:  Kp {gains['Kp']:.3g}, Ki {gains['Ki']:.3g}")
+
+    policies = {
+        "ladder": fancurve.default_policy(),
+        "pid default": pid.load_pid(configparser.ConfigParser()),
+        "pid tuned": pid.PIDController(args.target, gains["Kp"], gains["Ki"],
+                                       rate_limit=pid.DEFAULTS["RateLimit"]),
+    }
+    policies["pid default"].target = args.target
+    load = busy_idle()
+    print(f"{'policy':<12} {'mean duty %':>11} {'max °C':>7} {'overshoot °C':>12} {'writes/h':>9}")
+    for name, policy in policies.items():
+        writes, trace = simulate_policy(policy, args.hours, load)
+        settled = trace[len(trace) // 10:]
+        print(f"{name:<12} {mean_duty(writes, args.hours * 3600):11.1f} {max(settled):7.1f} "
+              f"{max(0.0, max(settled) - args.target):12.1f} {len(writes) / args.hours:9.0f}")
+
+
+def full_speed_bursts(loads, writes, temps, busy=50.0, idle=20.0):
+    # For each burst of load (from under `idle` % to `busy` % or more) that
+    # finds the fan below full speed: the die temperature when the fan
+    # reached 100 % during the burst, or None if it didn't
+    reached = []
+    t = 1
+    while t < len(loads):
+        if loads[t] >= busy and loads[t - 1] < idle:
+            end = t
+            while end < len(loads) and loads[end] >= busy:
+                end += 1
+            before = [dc for w, dc in writes if w < t]
+            if not before or before[-1] < 100:
+                full = next((w for w, dc in writes if t <= w < end and dc >= 100), None)
+                reached.append(None if full is None else temps[min(int(full), len(temps) - 1)])
+            t = end
+        t += 1
+    return reached
+
+
+def bench_predict(args):
+    # Replay a load trace through the thermal model under the policies the
+    # daemon builds from pwm.config (--config, or the shipped defaults) for
+    # ControlMode = curve and predictive, with the reactive ladder the
+    # original script ran for reference. `fan` sets the plant's fan
+    # conductance; the default is a fan that can just hold full load below
+    # the limit. The curves' load curve already sends the fan to 100 % in a
+    # burst over 80 % load; the forecast should do it for the rest before
+    # the temperature gets to the ladder's top step.
+    import fancurve
+    from channels import build_policy
+    from replay import bursty_load, read_config
+    from thermal import ThermalModel
+    from telemetry import TelemetryReader
+
+    if args.trace:
+        reader = TelemetryReader(args.trace)
+        loads = [sample[3] for sample in reader.samples()]
+        reader.close()
+        hours = len(loads) / 3600
+    else:
+        hours = args.hours
+        loads = bursty_load(hours * 3600)
+    load = lambda t: loads[min(int(t), len(loads) - 1)]
+
+    config = read_config(args.config) if args.config else configparser.ConfigParser()
+    if args.horizon is not None:
+        config.read_dict({"Predict": {"Horizon": str(args.horizon)}})
+    policies = {
+        "ladder": lambda: fancurve.FanPolicy({"temp": fancurve.FanCurve(
+            fancurve.DEFAULT_TEMP_POINTS, "step", fancurve.DEFAULT_TEMP_HYSTERESIS)}),
+        "curve": lambda: build_policy(config, "curve"),
+        "predictive": lambda: build_policy(config, "predictive"),
+    }
+    print(f"{hours:.1f} h of load, throttling above {args.limit:.1f} °C")
+    print(f"{'policy':<12} {'throttled s':>11} {'full bursts':>11} {'°C at full':>10} {'mean duty %':>11} "
+          f"{'max °C':>7} {'writes/h':>9}")
+    full = {}
+    for name, make_policy in policies.items():
+        start = time.perf_counter()
+        writes, trace = simulate_policy(make_policy(), hours, load, ThermalModel(fan=args.fan))
+        elapsed = time.perf_counter() - start
+        throttled = sum(1 for temp in trace if temp >= args.limit)
+        bursts = full_speed_bursts(loads, writes, trace)
+        reached = [temp for temp in bursts if temp is not None]
+        full[name] = len(reached)
+        at_full = f"{sum(reached) / len(reached):10.1f}" if reached else f"{'-':>10}"
+        print(f"{name:<12} {throttled:11d} {len(reached):5d} of {len(bursts):<2d} {at_full} "
+              f"{mean_duty(writes, hours * 3600):11.1f} {max(trace):7.1f} {len(writes) / hours:9.0f}   "
+              f"({elapsed:.1f} s)")
+    if not args.trace and not args.config:
+        assert full["predictive"] > full["curve"], "the forecast spun the fan up in no more bursts than the curves"
+
+
+def bench_output(args):
+    # PWM writes issued and suppressed by the output stage at several
+    # settings, under the ladder and the PID controller on the thermal model
+    import fancurve
+    import pid
+    from backends import OutputStage
+
+    settings = [  # resolution %, slew %/s, dwell s
+        (0.1, 5.0, 1.0),
+        (1.0, 5.0, 1.0),
+        (5.0, 5.0, 1.0),
+        (1.0, 5.0, 0.2),
+        (1.0, 0.0, 1.0),
+    ]
+    policies = {"ladder": fancurve.default_policy,
+                "pid": lambda: pid.load_pid(configparser.ConfigParser())}
+    print(f"{'policy':<7} {'res %':>5} {'slew %/s':>8} {'dwell s':>7} {'writes/h':>9} "
+          f"{'suppressed/h':>12} {'mean duty %':>11} {'max °C':>7}")
+    for name, make_policy in policies.items():
+        for resolution, slew, dwell in settings:
+            stages = []
+
+            def output(fan):
+                stages.append(OutputStage(fan, resolution, slew, dwell))
+                return stages[-1]
+
+            writes, trace = simulate_policy(make_policy(), args.hours, busy_idle(), output=output)
+            stage = stages[0]
+            print(f"{name:<7} {resolution:5.1f} {slew:8.1f} {dwell:7.1f} {stage.issued / args.hours:9.0f} "
+                  f"{stage.suppressed / args.hours:12.0f} {mean_duty(writes, args.hours * 3600):11.1f} "
+                  f"{max(trace):7.1f}")
+
+
+def bench_telemetry(args):
+    # Per-sample cost and write calls of the old formatted log line plus
+    # stdout flush versus the ring buffer and binary log
+    from telemetry import TelemetryBuffer, TelemetryLog, TelemetryReader
+
+    root = tempfile.mkdtemp()
+    try:
+        writes = 0
+        with open(os.path.join(root, "text.log"), "w") as f:
+            start = time.perf_counter()
+            for i in range(args.samples):
+                f.write(f"CPU Temp is: {45.0 + i % 10}°C, Fan speed is: {75}%, Load is: {12.5}%\n")
+                f.flush()
+                writes += 1
+            text = (time.perf_counter() - start) / args.samples
+        text_size = os.path.getsize(os.path.join(root, "text.log"))
+
+        path = os.path.join(root, "telemetry.bin")
+        buffer = TelemetryBuffer(log=TelemetryLog(path))
+        start = time.perf_counter()
+        for i in range(args.samples):
+            buffer.append(1e9 + i, 45.0 + i % 10, 1500.0, 12.5, 75.0)
+        buffer.close()
+        binary = (time.perf_counter() - start) / args.samples
+
+        reader = TelemetryReader(path)
+        start = time.perf_counter()
+        hours = sum(1 for _ in reader.aggregate(3600))
+        aggregate = time.perf_counter() - start
+        reader.close()
+        binary_size = os.path.getsize(path)
+    finally:
+        shutil.rmtree(root)
+
+    print(f"text log:        {text * 1e6:10.2f} us/sample, {writes} flushes, {text_size / args.samples:.0f} B/sample")
+    print(f"binary log:      {binary * 1e6:10.2f} us/sample, {-(-args.samples // buffer.batch)} batches, "
+          f"{binary_size / args.samples:.0f} B/sample")
+    print(f"hourly rollup:   {aggregate * 1e3:10.2f} ms for {hours} hours")
+
+
+class ForkSensors:
+    # Sensors that pay the old cost: a shell pipeline fork per value
+    def __init__(self, root):
+        self.temp_cmd = f"cat {root}/sys/class/thermal/thermal_zone0/temp | sed 's/[^0-9.]//g'"
+        self.freq_cmd = f"cat {root}/sys/devices/system/cpu/cpu0/cpufreq/scaling_cur_freq | awk '{{print $1}}'"
+
+    def temperature(self):
+        return float(subprocess.getoutput(self.temp_cmd)) / 1000
+
+    def frequency(self):
+        return int(subprocess.getoutput(self.freq_cmd)) * 1000
+
+    def close(self):
+        pass
+
+
+def heartbeat(root, seconds, period=0.01):
+    # Schedule a callback every `period` s on the Tk loop and record how late
+    # each one ran; that lateness is what a user feels as stutter
+    late = []
+    end = time.perf_counter() + seconds
+    expected = [time.perf_counter() + period]
+
+    def beat():
+        now = time.perf_counter()
+        late.append(now - expected[0])
+        if now >= end:
+            root.quit()
+            return
+        expected[0] = now + period
+        root.after(int(period * 1000), beat)
+
+    root.after(int(period * 1000), beat)
+    root.mainloop()
+    late.sort()
+    return late[len(late) // 2], late[int(len(late) * 0.99)], late[-1]
+
+
+@contextlib.contextmanager
+def sim_daemon(path, sensors, interval=1.0):
+    # daemon.py's controller and socket server on a simulated fan, running on
+    # their own event loop thread, serving `path` until the block exits
+    import daemon
+    from ipc import FanServer
+
+    fan = SimulatedBackend()
+    fan.setup(0)
+    controller = daemon.FanController(fan, sensors, sample_interval=interval)
+    server = FanServer(controller, path, group=None)
+    loop = asyncio.new_event_loop()
+    ready = threading.Event()
+    tasks = []
+
+    async def serve():
+        await server.start()
+        tasks.append(asyncio.ensure_future(controller.run()))
+        ready.set()
+        try:
+            await tasks[0]
+        except asyncio.CancelledError:
+            pass
+        await server.close()
+
+    thread = threading.Thread(target=loop.run_until_complete, args=(serve(),), name="sim-daemon")
+    thread.start()
+    ready.wait()
+    try:
+        yield controller
+    finally:
+        loop.call_soon_threadsafe(tasks[0].cancel)
+        thread.join()
+        loop.close()
+
+
+def bench_gui(args):
+    # Main-loop responsiveness with sampling on the Tk thread (the old
+    # update_gui: two forks and a reconfigure of every label each second)
+    # versus PWMFanControl talking to a simulated daemon on a temporary
+    # socket, with the slider moved every `--drag` seconds
+    import tkinter as tk
+    import pwm
+    from clock import Clock
+
+    root_dir = make_fake_sysfs(tempfile.mkdtemp())
+    path = os.path.join(root_dir, "fan.sock")
+    cwd = os.getcwd()
+    os.chdir(root_dir)
+    try:
+        sensors = ForkSensors(root_dir)
+
+        root = tk.Tk()
+        labels = [tk.Label(root, text="") for _ in range(3)]
+        for label in labels:
+            label.pack()
+
+        def old_update_gui():
+            temp = sensors.temperature()
+            freq = sensors.frequency()
+            labels[0].config(text=f"CPU Temp: {temp}°C")
+            labels[1].config(text=f"CPU Frequency: {freq / 1000000} MHz")
+            labels[2].config(text=f"Elapsed Time: {time.time()}")
+            root.after(1000, old_update_gui)
+
+        old_update_gui()
+        before = heartbeat(root, args.seconds)
+        root.destroy()
+
+        logging.disable(logging.INFO)
+        with sim_daemon(path, SweepSensors(Clock())) as controller:
+            root = tk.Tk()
+            app = pwm.PWMFanControl(root, socket_path=path)
+            moves = [0]
+
+            def drag():
+                moves[0] += 1
+                app.pwm_scale.set(moves[0] * 7 % 101)
+                root.after(int(args.drag * 1000), drag)
+
+            root.after(int(args.drag * 1000), drag)
+            after = heartbeat(root, args.seconds)
+            wanted = float(app.pwm_scale.get())
+            time.sleep(0.5)
+            held = controller.override
+            shown = app.fan_status.get()
+            app.worker.stop()
+            app.store.close()
+            root.destroy()
+    finally:
+        logging.disable(logging.NOTSET)
+        os.chdir(cwd)
+        shutil.rmtree(root_dir)
+
+    print(f"{'main loop lateness':<20} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for name, (p50, p99, worst) in (("sampling on Tk", before), ("daemon client", after)):
+        print(f"{name:<20} {p50 * 1e3:8.2f} {p99 * 1e3:8.2f} {worst * 1e3:8.2f}")
+    print(f"{moves[0]} slider moves; last {wanted:.0f} %, daemon override {held}, fan status {shown}")
+
+
+def bench_ipc(args):
+    # Load-test the daemon's socket API: a controller sampling at `rate` Hz
+    # with `clients` subscribers on their own event loop thread, plus one
+    # client holding an override
+    import daemon
+    from ipc import FanServer, FanClient
+
+    path = os.path.join(tempfile.mkdtemp(), "fan.sock")
+    fan = SimulatedBackend()
+    fan.setup(0)
+    controller = daemon.FanController(fan, SweepSensors(SimulatedClock()),
+                                      sample_interval=1.0 / args.rate)
+    server = FanServer(controller, path, group=None)
+
+    publish = server.publish
+    publish_time = []
+
+    def timed_publish(c):
+        start = time.perf_counter()
+        publish(c)
+        publish_time.append(time.perf_counter() - start)
+
+    controller.listeners[controller.listeners.index(publish)] = timed_publish
+
+    received = [0] * args.clients
+    latency = []
+    subscribed = []
+    ready = threading.Event()
+
+    async def subscriber(i):
+        reader, writer = await asyncio.open_unix_connection(path)
+        writer.write(b'{"cmd": "subscribe"}\n')
+        await reader.readline()
+        subscribed.append(i)
+        if len(subscribed) == args.clients:
+            ready.set()
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            received[i] += 1
+            if i == 0:
+                latency.append(time.time() - json.loads(line)["time"])
+        writer.close()
+
+    async def all_subscribers():
+        await asyncio.gather(*(subscriber(i) for i in range(args.clients)))
+
+    def clients():
+        loop = asyncio.new_event_loop()
+        loop.run_until_complete(all_subscribers())
+        loop.close()
+
+    async def session():
+        await server.start()
+        thread = threading.Thread(target=clients, daemon=True)
+        thread.start()
+        task = asyncio.ensure_future(controller.run())
+        await asyncio.get_running_loop().run_in_executor(None, ready.wait)
+
+        override = await asyncio.get_running_loop().run_in_executor(None, FanClient, path)
+        await asyncio.get_running_loop().run_in_executor(None, override.set_override, 100)
+        await asyncio.sleep(args.seconds)
+        forced = controller.target
+
+        task.cancel()
+        await server.close()
+        await asyncio.get_running_loop().run_in_executor(None, thread.join)
+        override.close()
+        return forced
+
+    logging.disable(logging.INFO)
+    loop = asyncio.new_event_loop()
+    forced = loop.run_until_complete(session())
+    loop.close()
+    logging.disable(logging.NOTSET)
+    shutil.rmtree(os.path.dirname(path))
+
+    samples = len(publish_time)
+    publish_time.sort()
+    latency.sort()
+    print(f"clients:         {args.clients:10d}")
+    print(f"samples:         {samples:10d} at {args.rate:g} Hz")
+    print(f"delivered:       {sum(received) / (samples * args.clients) * 100:10.1f} % ({server.dropped} dropped)")
+    print(f"publish:         {publish_time[samples // 2] * 1e6:10.1f} us p50, "
+          f"{publish_time[int(samples * 0.99)] * 1e6:.1f} us p99 per sample")
+    print(f"latency:         {latency[len(latency) // 2] * 1e3:10.2f} ms p50, "
+          f"{latency[int(len(latency) * 0.99)] * 1e3:.2f} ms p99 to client 0")
+    print(f"override held:   {forced == 100!s:>10}")
+
+
+def bench_channels(args):
+    # Real time per sample tick for N fans, each on its own hwmon zone out of
+    # `zones`: one controller over N channels against N controllers sharing
+    # the loop, all reading a fake sysfs tree
+    import daemon
+    from channels import FanChannel
+    from sensors import ZoneSensor
+
+    root = make_fake_sysfs(tempfile.mkdtemp())
+    try:
+        for i in range(args.zones):
+            hwmon = os.path.join(root, f"sys/class/hwmon/hwmon{i}")
+            os.makedirs(hwmon)
+            with open(os.path.join(hwmon, "name"), "w") as f:
+                f.write(f"zone{i}\n")
+            with open(os.path.join(hwmon, "temp1_input"), "w") as f:
+                f.write(f"{40000 + 1000 * i}\n")
+
+        print(f"{'channels':>8} {'one controller us/tick':>23} {'N controllers us/tick':>22} {'sensor reads/tick':>18}")
+        for n in args.channels:
+            cpu = CPUSensors(root=root)
+            zones = [ZoneSensor(f"zone{i}", root) for i in range(min(n, args.zones))]
+            fans = [SimulatedBackend() for _ in range(n)]
+
+            def timed(controllers):
+                clock = SimulatedClock()
+                ticks = []
+                controllers[-1].listeners.append(lambda c: ticks.append(None))
+
+                async def run_all():
+                    await asyncio.gather(*(c.run() for c in controllers))
+
+                start = time.perf_counter()
+                run_simulated(clock, run_all(), args.seconds)
+                return (time.perf_counter() - start) / max(len(ticks), 1)
+
+            channels = [FanChannel(f"fan{i}", fans[i], zones[i % len(zones)]) for i in range(n)]
+            one = timed([daemon.FanController(sensors=cpu, load=lambda: 50.0, channels=channels)])
+            many = timed([daemon.FanController(sensors=cpu, load=lambda: 50.0, channels=[
+                FanChannel(f"fan{i}", fans[i], zones[i % len(zones)])]) for i in range(n)])
+            # One controller: each shared zone once plus the frequency
+            print(f"{n:8d} {one * 1e6:23.1f} {many * 1e6:22.1f} {len(zones) + 1:18d}")
+            for sensors in [cpu] + zones:
+                sensors.close()
+    finally:
+        shutil.rmtree(root)
+
+
+def pulse_train(callback, hz, seconds):
+    # Call `callback` `hz` times a second for `seconds`, like a tach wire
+    # firing edge interrupts; returns the number of pulses sent
+    start = time.perf_counter()
+    sent = 0
+    while True:
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds:
+            return sent
+        for _ in range(int(elapsed * hz) - sent):
+            callback()
+        sent = max(sent, int(elapsed * hz))
+
+
+def bench_tach(args):
+    # Edge-callback cost of the lock-free counter against a locked counter
+    # and per-edge timestamps, RPM accuracy with a pulse train on another
+    # thread, and how long a stalled or worn fan takes to be reported
+    import daemon
+    import tach
+    from channels import FanChannel
+
+    counter = tach.TachCounter()
+    lock = threading.Lock()
+    locked = [0]
+    stamps = []
+
+    def locked_pulse(channel=None):
+        with lock:
+            locked[0] += 1
+
+    def stamped_pulse(channel=None):
+        stamps.append(time.monotonic())
+
+    n = 1000000
+    print(f"lock-free pulse():  {per_sample(counter.pulse, n) * 1e9:8.1f} ns/edge")
+    print(f"locked counter:     {per_sample(locked_pulse, n) * 1e9:8.1f} ns/edge")
+    print(f"per-edge timestamp: {per_sample(stamped_pulse, n) * 1e9:8.1f} ns/edge")
+    print()
+
+    print(f"{'edges/s':>8} {'sent/s':>9} {'RPM read':>9} {'RPM true':>9} {'error %':>8} {'rpm() us':>9}")
+    for hz in args.rate:
+        counter = tach.TachCounter(window=1.0)
+        readings = []
+        done = threading.Event()
+
+        def reader():
+            while not done.is_set():
+                start = time.perf_counter()
+                rpm = counter.rpm()
+                readings.append((rpm, time.perf_counter() - start))
+                done.wait(0.1)
+
+        thread = threading.Thread(target=reader)
+        thread.start()
+        sent = pulse_train(counter.pulse, hz, args.seconds)
+        done.set()
+        thread.join()
+
+        measured = [rpm for rpm, _ in readings[len(readings) // 2:] if rpm is not None]
+        rpm = sum(measured) / len(measured)
+        true = hz * 60.0 / counter.pulses_per_rev
+        cost = sum(c for _, c in readings) / len(readings)
+        print(f"{hz:8d} {sent / args.seconds:9.0f} {rpm:9.0f} {true:9.0f} "
+              f"{100 * (rpm - true) / true:8.2f} {cost * 1e6:9.2f}")
+    print()
+
+    # A fan at a steady 60 %: worn to `health` at t=600 s on simulated time
+    for health in (0.0, 0.4):
+        clock = SimulatedClock()
+        fan = SimulatedBackend(clock)
+        fan.setup(0)
+        model = tach.FanModel()
+        sensor = tach.SimulatedTach(fan, model, clock)
+        channel = FanChannel("fan", fan, StepSensors(clock, 0.0), tach=sensor, monitor=tach.FanMonitor(model))
+        controller = daemon.FanController(sensors=channel.sensors, channels=[channel])
+        controller.set_override(60)
+        detected = []
+
+        verdict = "stalled" if health < 0.1 else "degraded"
+
+        def watch(c, health=health, verdict=verdict):
+            if clock.now() >= 600.0:
+                sensor.health = health
+                if c.channels[0].fault == verdict and not detected:
+                    detected.append(clock.now() - 600.0)
+
+        controller.listeners.append(watch)
+        run_simulated(clock, controller.run(), 900.0)
+        print(f"fan at {health:.0%} of expected RPM: {verdict} after "
+              f"{detected[0] if detected else float('nan'):.1f} s")
+
+
+def bench_startup(args):
+    # Wall time from launching daemon.py (sim backend, fake sysfs) to its
+    # first duty-cycle write and to its socket accepting clients, against
+    # a bare interpreter start. Fails if the median first write is later
+    # than `budget` ms.
+    tmp = tempfile.mkdtemp()
+    root = make_fake_sysfs(os.path.join(tmp, "root"), temp=50.0)
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "daemon.py"),
+               "--backend", "sim", "--root", root, "--self-test", "never", "--telemetry", "",
+               "--config", os.path.join(tmp, "pwm.config"), "--socket", os.path.join(tmp, "fan.sock")]
+    marks = {"first duty": "Fans started at", "socket": "Listening on"}
+    times = {name: [] for name in ["interpreter"] + list(marks)}
+    try:
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "-c", "pass"], check=True)
+            times["interpreter"].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            proc = subprocess.Popen(command, stderr=subprocess.PIPE, text=True)
+            pending = dict(marks)
+            for line in proc.stderr:
+                for name, text in list(pending.items()):
+                    if text in line:
+                        times[name].append(time.perf_counter() - start)
+                        del pending[name]
+                if not pending:
+                    break
+            proc.terminate()
+            proc.communicate()
+            if pending:
+                raise RuntimeError(f"daemon exited before: {', '.join(pending)}")
+    finally:
+        shutil.rmtree(tmp)
+
+    for name, samples in times.items():
+        samples.sort()
+        print(f"{name + ':':<16} {samples[len(samples) // 2] * 1e3:8.1f} ms median, "
+              f"{samples[-1] * 1e3:8.1f} ms max")
+    first = times["first duty"][len(times["first duty"]) // 2] * 1e3
+    print(f"{'budget:':<16} {args.budget:8.1f} ms to the first duty")
+    assert first <= args.budget, f"first duty write {first:.1f} ms after launch, over the {args.budget:.0f} ms budget"
+
+
+def bench_metrics(args):
+    # Per-tick cost of the controller with and without metrics recording
+    # (nobody scraping), then scrapes of a live exporter over HTTP in both
+    # exposition formats
+    import urllib.request
+    import daemon
+    from channels import FanChannel
+    from metrics import Metrics, MetricsServer
+
+    root = make_fake_sysfs(tempfile.mkdtemp())
+    cpu = CPUSensors(root=root)
+    try:
+        def controller(metrics):
+            channels = [FanChannel(f"fan{i}", SimulatedBackend(), cpu) for i in range(args.channels)]
+            c = daemon.FanController(sensors=cpu, load=lambda: 50.0, channels=channels)
+            c.metrics = metrics
+            return c
+
+        def tick_cost(c):
+            ticks = []
+            c.listeners.append(lambda _: ticks.append(None))
+            start = time.perf_counter()
+            run_simulated(SimulatedClock(), c.run(), args.seconds)
+            return (time.perf_counter() - start) / max(len(ticks), 1)
+
+        # Alternating, best of three, so warm-up doesn't favour either
+        off = on = float("inf")
+        for _ in range(3):
+            off = min(off, tick_cost(controller(None)))
+            metrics = Metrics()
+            live = controller(metrics)
+            on = min(on, tick_cost(live))
+        print(f"{args.channels} fans, {args.seconds:.0f} simulated seconds")
+        print(f"{'metrics off':>12}: {off * 1e6:8.1f} us/tick")
+        print(f"{'metrics on':>12}: {on * 1e6:8.1f} us/tick  ({(on - off) * 1e6:+.1f})")
+
+        server = MetricsServer(live, metrics, port=0)
+        server.start()
+        url = f"http://{server.address[0]}:{server.address[1]}/metrics"
+        try:
+            print(f"\n{'format':>12} {'ms/scrape':>10} {'bytes':>7}  content type")
+            for name, accept in (("prometheus", "text/plain"),
+                                 ("openmetrics", "application/openmetrics-text; version=1.0.0")):
+                request = urllib.request.Request(url, headers={"Accept": accept})
+                start = time.perf_counter()
+                for _ in range(args.scrapes):
+                    with urllib.request.urlopen(request) as response:
+                        body = response.read().decode()
+                        kind = response.headers["Content-Type"]
+                elapsed = (time.perf_counter() - start) / args.scrapes
+                print(f"{name:>12} {elapsed * 1e3:10.2f} {len(body):7d}  {kind}")
+            assert body.endswith("# EOF\n")
+            print()
+            for line in body.splitlines():
+                if line.startswith(("fan_duty_percent", "fan_pwm_writes_total", "fan_stage_seconds_count",
+                                    'fan_sensor_read_seconds_bucket{sensor="frequency",le="1e-05"}')):
+                    print("  " + line)
+            print(f"\n{server.scrapes} scrapes served")
+        finally:
+            server.close()
+    finally:
+        cpu.close()
+        shutil.rmtree(root)
+
+
+def bench_replay(args):
+    # The replay harness against the daemon itself on the simulated event
+    # loop (simulate_policy) for one parameter set of each mode, then replay
+    # time as the number of parameter sets grows, with the plants stepped
+    # as numpy arrays and one by one
+    import fancurve
+    import replay
+    from channels import build_policy
+    from thermal import ThermalModel
+
+    loads = replay.profile_loads(args.profile, args.hours * 3600)
+    seconds = len(loads)
+    print(f"{args.profile}, {args.hours:.1f} h")
+    print(f"{'mode':<11} {'peak °C':>15} {'mean °C':>15} {'writes':>11} {'seconds':>15}")
+    print(f"{'':<11} {'daemon replay':>15} {'daemon replay':>15} {'daemon replay':>11} {'daemon replay':>15}")
+    for mode in replay.MODES:
+        sets = replay.parameter_sets(["pwm.config"], [mode], {})
+        start = time.perf_counter()
+        writes, trace = simulate_policy(build_policy(replay.read_config("pwm.config"), mode), args.hours,
+                                        lambda t: loads[min(int(t), seconds - 1)], ThermalModel())
+        daemon_time = time.perf_counter() - start
+        start = time.perf_counter()
+        result, = replay.replay(sets, loads)
+        replay_time = time.perf_counter() - start
+        print(f"{mode:<11} {max(trace):7.1f} {result.peak:7.1f} {sum(trace) / len(trace):7.1f} {result.mean:7.1f} "
+              f"{len(writes) - 1:5d} {result.changes:5d} {daemon_time:7.2f} {replay_time:7.2f}")
+
+    numpy = fancurve.numpy()
+    print(f"\n{'sets':>6} {'numpy s':>8} {'loop s':>8} {'x real time':>12}")
+    for n in args.sets:
+        sets = replay.parameter_sets(["pwm.config"], ["curve"],
+                                     {"fan": [0.1 + 0.9 * i / max(n - 1, 1) for i in range(n)]})
+        times = []
+        for np in (numpy, None):
+            fancurve.np = np
+            start = time.perf_counter()
+            if np is not None or n <= args.loop_max:
+                replay.replay(sets, loads)
+                times.append(time.perf_counter() - start)
+            else:
+                times.append(float("nan"))
+        fancurve.np = numpy
+        best = min(t for t in times if t == t)
+        print(f"{n:6d} {times[0]:8.2f} {times[1]:8.2f} {seconds * n / best:12,.0f}")
+
+
+def bench_throttle(args):
+    # Cost of reading the throttle state each tick: the sysfs attribute,
+    # and vcgencmd (a stand-in script here) forked every tick or cached
+    import sensors
+
+    root = make_fake_sysfs(tempfile.mkdtemp())
+    try:
+        firmware = os.path.join(root, "sys/devices/platform/soc/soc:firmware")
+        os.makedirs(firmware)
+        with open(os.path.join(firmware, "get_throttled"), "w") as f:
+            f.write("50005\n")
+        cpu = sensors.CPUSensors(root=root)
+        sysfs = per_sample(cpu.throttled, args.samples)
+        cpu.close()
+
+        os.remove(os.path.join(firmware, "get_throttled"))
+        bin_dir = os.path.join(root, "bin")
+        os.makedirs(bin_dir)
+        with open(os.path.join(bin_dir, "vcgencmd"), "w") as f:
+            f.write("#!/bin/sh\necho throttled=0x50005\n")
+        os.chmod(os.path.join(bin_dir, "vcgencmd"), 0o755)
+        path = os.environ["PATH"]
+        os.environ["PATH"] = bin_dir + os.pathsep + path
+        try:
+            ticks = max(1, args.samples // 100)
+            forked = per_sample(sensors.vcgencmd_throttled, ticks)
+            clock = SimulatedClock()
+            cpu = sensors.CPUSensors(root=root, now=clock.now)
+
+            def tick():
+                clock.sleep(1.0)
+                return cpu.throttled()
+
+            cached = per_sample(tick, ticks)
+            assert cpu.throttled() == sensors.UNDER_VOLTAGE | sensors.THROTTLED
+            cpu.close()
+        finally:
+            os.environ["PATH"] = path
+    finally:
+        shutil.rmtree(root)
+    print(f"sysfs pread:          {sysfs * 1e6:10.2f} us/tick")
+    print(f"vcgencmd every tick:  {forked * 1e6:10.2f} us/tick")
+    print(f"vcgencmd, {sensors.THROTTLE_CACHE:.0f} s cache: {cached * 1e6:10.2f} us/tick at 1 Hz")
+
+    # The daemon against the simulated firmware, with the full-fan trigger
+    # and without it, on a bursty load. The shipped policies stay under the
+    # limit; a PID held close to it (`--late-target`) reacts too late and
+    # is what the trigger is for.
+    import daemon
+    import fancurve
+    import pid
+    from channels import FanChannel
+    from replay import bursty_load
+    from thermal import ThermalModel, SimulatedSensors
+
+    def late_pid():
+        policy = pid.load_pid(configparser.ConfigParser())
+        policy.target = args.late_target
+        return policy
+
+    loads = bursty_load(args.hours * 3600)
+    demanded = sum(loads) / 100
+    policies = {"curve": fancurve.default_policy, "pid": lambda: pid.load_pid(configparser.ConfigParser()),
+                f"pid {args.late_target:g}": late_pid}
+    print(f"\n{args.hours:.1f} h bursty load, soft limit {args.limit:.0f} °C capping 1500 to 1200 MHz")
+    print(f"{'policy':<6} {'ambient':>7} {'trigger':>7} {'capped s':>8} {'events':>6} {'lost CPU-s':>10} "
+          f"{'lost %':>6} {'max °C':>6} {'duty %':>6}")
+    logging.getLogger("daemon").setLevel(logging.ERROR)  # one warning per throttle event
+    throttled = False
+    for name, make_policy in policies.items():
+        for ambient in args.ambient:
+            without = None
+            for trigger in (False, True):
+                clock = SimulatedClock()
+                fan = SimulatedBackend(clock)
+                fan.setup(0)
+                sim = SimulatedSensors(ThermalModel(ambient=ambient), fan, clock,
+                                       lambda t: loads[min(int(t), len(loads) - 1)], soft_limit=args.limit)
+                policy = make_policy()
+                if hasattr(policy, "now"):
+                    policy.now = clock.now
+                controller = daemon.FanController(sensors=sim, load=sim.load,
+                                                  channels=[FanChannel("fan", fan, sim, policy)])
+                if not trigger:
+                    controller.read_throttle = None
+                capped = []
+                temps = []
+                late = []  # ticks after a throttle bit came on with the fan below 100 %
+
+                def listen(c):
+                    if trigger and capped and capped[-1] and len(capped) > 1 and not capped[-2] \
+                            and fan.duty != 100:
+                        late.append(clock.now())
+                    capped.append(sim.freq < sim.max_freq)
+                    temps.append(sim.model.soc_temp)
+
+                controller.listeners.append(listen)
+                run_simulated(clock, controller.run(), args.hours * 3600)
+                events = sum(1 for a, b in zip(capped, capped[1:]) if b and not a)
+                print(f"{name:<6} {ambient:7.0f} {'on' if trigger else 'off':>7} {sum(capped):8d} {events:6d} "
+                      f"{sim.lost:10.0f} {100 * sim.lost / demanded:6.2f} {max(temps):6.1f} "
+                      f"{mean_duty(fan.writes, args.hours * 3600):6.1f}")
+                assert not late, f"{name} at {ambient:g} °C: fan below 100% a tick after throttling at {late[0]:.0f} s"
+                if without is None:
+                    without = sum(capped)
+                elif without:
+                    throttled = True
+                    assert sum(capped) < without, f"{name} at {ambient:g} °C: the trigger didn't cut capped time"
+    assert throttled, "nothing throttled; the scenario no longer exercises the trigger"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fan control micro-benchmarks")
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    p = sub.add_parser("sensors", help="sysfs pread vs vcgencmd fork per sample")
+    p.add_argument("--samples", type=int, default=10000)
+    p.set_defaults(func=bench_sensors)
+
+    p = sub.add_parser("writes", help="duty-cycle writes per hour of daemon control")
+    p.add_argument("--hours", type=float, default=1.0)
+    p.add_argument("--speed", type=float, default=float("inf"),
+                   help="simulated seconds per real second (default: no sleeping)")
+    p.add_argument("--interval", type=float, default=1.0, help="sample interval in seconds")
+    p.set_defaults(func=bench_writes)
+
+    p = sub.add_parser("latency", help="threshold crossing to new duty cycle, simulated clock")
+    p.add_argument("--interval", type=float, nargs="+", default=[0.1, 0.25, 1.0, 5.0])
+    p.set_defaults(func=bench_latency)
+
+    p = sub.add_parser("curve", help="fan curve batch evaluation and per-tick cost")
+    p.add_argument("--samples", type=int, default=86400)
+    p.set_defaults(func=bench_curve)
+
+    p = sub.add_parser("pid", help="PID vs ladder on the simulated thermal model")
+    p.add_argument("--hours", type=float, default=4.0)
+    p.add_argument("--target", type=float, default=50.0, help="PID target temperature")
+    p.set_defaults(func=bench_pid)
+
+    p = sub.add_parser("predict", help="predictive vs reactive control replaying a load trace")
+    p.add_argument("--hours", type=float, default=4.0, help="length of the synthetic trace")
+    p.add_argument("--trace", help="telemetry log to replay the load column of")
+    p.add_argument("--horizon", type=float, help="[Predict] Horizon, default from the config")
+    p.add_argument("--config", help="pwm.config to build the policies from (default: the shipped defaults)")
+    p.add_argument("--limit", type=float, default=47.0, help="°C treated as throttling")
+    p.add_argument("--fan", type=float, default=0.6, help="plant fan conductance at 100 %% duty, W/K")
+    p.set_defaults(func=bench_predict)
+
+    p = sub.add_parser("output", help="PWM writes issued vs suppressed by the output stage")
+    p.add_argument("--hours", type=float, default=4.0)
+    p.set_defaults(func=bench_output)
+
+    p = sub.add_parser("startup", help="launch to first fan write and to the socket being up")
+    p.add_argument("--runs", type=int, default=5)
+    p.add_argument("--budget", type=float, default=300.0, help="ms allowed from launch to the first fan write")
+    p.set_defaults(func=bench_startup)
+
+    p = sub.add_parser("throttle", help="throttle state read cost, and the full-fan trigger on simulated firmware")
+    p.add_argument("--samples", type=int, default=100000)
+    p.add_argument("--hours", type=float, default=4.0)
+    p.add_argument("--ambient", type=float, nargs="+", default=[25.0, 35.0])
+    p.add_argument("--limit", type=float, default=60.0, help="firmware soft temperature limit")
+    p.add_argument("--late-target", type=float, default=55.0,
+                   help="PID target close enough to the limit to throttle")
+    p.set_defaults(func=bench_throttle)
+
+    p = sub.add_parser("replay", help="replay harness against the daemon on the simulated loop, and scaling")
+    p.add_argument("--profile", default="bursty")
+    p.add_argument("--hours", type=float, default=1.0)
+    p.add_argument("--sets", type=int, nargs="+", default=[1, 10, 100, 1000])
+    p.add_argument("--loop-max", type=int, default=100, help="largest set count to step one by one")
+    p.set_defaults(func=bench_replay)
+
+    p = sub.add_parser("metrics", help="controller cost of the Prometheus exporter and scrape latency")
+    p.add_argument("--channels", type=int, default=4)
+    p.add_argument("--seconds", type=float, default=3600.0)
+    p.add_argument("--scrapes", type=int, default=200)
+    p.set_defaults(func=bench_metrics)
+
+    p = sub.add_parser("telemetry", help="text log lines vs binary telemetry per sample")
+    p.add_argument("--samples", type=int, default=100000)
+    p.set_defaults(func=bench_telemetry)
+
+    p = sub.add_parser("gui", help="Tk main-loop lateness, sampling on Tk vs a simulated daemon's client")
+    p.add_argument("--seconds", type=float, default=20.0)
+    p.add_argument("--drag", type=float, default=0.1, help="seconds between slider moves")
+    p.set_defaults(func=bench_gui)
+
+    p = sub.add_parser("ipc", help="socket API fan-out to many subscribers")
+    p.add_argument("--clients", type=int, default=100)
+    p.add_argument("--rate", type=float, default=10.0, help="samples per second")
+    p.add_argument("--seconds", type=float, default=5.0)
+    p.set_defaults(func=bench_ipc)
+
+    p = sub.add_parser("channels", help="per-tick cost as the number of fan channels grows")
+    p.add_argument("--channels", type=int, nargs="+", default=[1, 4, 16, 64])
+    p.add_argument("--zones", type=int, default=4, help="distinct temperature sensors")
+    p.add_argument("--seconds", type=float, default=3600.0, help="simulated seconds per run")
+    p.set_defaults(func=bench_channels)
+
+    p = sub.add_parser("tach", help="tach pulse counting at high edge rates and fault detection")
+    p.add_argument("--rate", type=int, nargs="+", default=[1000, 10000, 20000, 50000],
+                   help="tach edges per second")
+    p.add_argument("--seconds", type=float, default=3.0)
+    p.set_defaults(func=bench_tach)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
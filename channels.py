@@ -0,0 +1,160 @@
+#!/usr/bin/python3
+
+from backends import OutputStage, create_backend
+from sensors import ZoneSensor
+from fancurve import FanPolicy, INPUTS, curve_from_section, default_policy, load_policy
+from pid import load_pid
+from predict import load_predictive
+from tach import load_tach
+
+CHANNEL_PREFIX = "Fan:"
+
+# Defaults for the [Output] section, which any [Fan:<name>] section may
+# override key by key
+OUTPUT_DEFAULTS = {
+    "Frequency": None,   # PWM carrier in Hz: 100 for gpio, 25000 for sysfs
+    "Resolution": 1.0,   # % duty steps written to the fan
+    "SlewRate": 5.0,     # % duty per second while ramping
+    "Dwell": 1.0,        # seconds between ramp steps
+}
+
+
+class FanChannel:
+    # One fan and the zone it cools. `sensors` gives the zone temperature;
+    # CPU frequency and load are read once per tick for all channels. With
+    # a `tach` (see tach.py) the fan's RPM is read every tick and `monitor`
+    # judges it against the commanded duty. Writes go through `output`
+    # (an OutputStage around `fan`), and `duty` is the duty it last wrote.
+    def __init__(self, name, fan, sensors, policy=None, tach=None, monitor=None, output=None):
+        self.name = name
+        self.fan = fan
+        self.output = output or OutputStage(fan)
+        self.sensors = sensors
+        self.policy = policy or default_policy()
+        self.tach = tach
+        self.monitor = monitor
+
+        self.inputs = None
+        self.target = None
+        self.logged = None     # what the last "Fan target" line reported
+        self.override = None
+        self.rpm = None
+        self.fault = None      # monitor verdict: "ok", "degraded", "stalled"
+
+    @property
+    def duty(self):
+        return self.output.duty or 0
+
+    @duty.setter
+    def duty(self, duty):
+        # The fan was driven to `duty` outside the output stage
+        self.output.duty = duty
+
+
+def channel_sections(config):
+    return [s for s in config.sections() if s.startswith(CHANNEL_PREFIX)]
+
+
+def output_settings(config, section=None):
+    # Output keys for one fan: the channel section, then [Output]
+    shared = config["Output"] if config.has_section("Output") else {}
+    settings = {}
+    for key, default in OUTPUT_DEFAULTS.items():
+        value = section.get(key) if section is not None else None
+        if value is None:
+            value = shared.get(key)
+        settings[key] = default if value is None else float(value)
+    return settings
+
+
+def create_output(kind, settings, clock=None, **target):
+    # Backend of `kind` for `target` (pin, or chip and channel) wrapped in
+    # its OutputStage
+    frequency = settings["Frequency"] or (25000 if kind == "sysfs" else 100)
+    fan = create_backend(kind, frequency=int(frequency), clock=clock, **target)
+    return fan, OutputStage(fan, settings["Resolution"], settings["SlewRate"], settings["Dwell"])
+
+
+def build_policy(config, mode, section=None):
+    # A fresh policy (hysteresis, PID and model state are per channel). A
+    # channel section with its own Points replaces the [Curve] temperature
+    # curve; predictive mode runs the curves on a forecast temperature.
+    if mode == "pid":
+        return load_pid(config)
+    if section is None or "Points" not in section:
+        policy = load_policy(config)
+    else:
+        curves = {"temp": curve_from_section(section, INPUTS["temp"][1])}
+        for name, (shared, resolution) in INPUTS.items():
+            if name != "temp" and config.has_section(shared):
+                curves[name] = curve_from_section(config[shared], resolution)
+        policy = FanPolicy(curves)
+    if mode == "predictive":
+        return load_predictive(config, policy)
+    return policy
+
+
+def policy_config(store):
+    # What build_policies reads: the control mode and every section a policy
+    # is built from. Comparing it across reloads tells a curve or PID edit
+    # from one that only touched FanSpeed or FanPin.
+    config = store.config
+    names = [shared for shared, _ in INPUTS.values()] + ["PID", "Predict"] + channel_sections(config)
+    return store.settings.control_mode, {name: dict(config[name]) for name in names if config.has_section(name)}
+
+
+def build_policies(store):
+    # Policy per channel name, for reloading after pwm.config changes
+    config = store.config
+    mode = store.settings.control_mode
+    sections = channel_sections(config)
+    if not sections:
+        return {"fan": build_policy(config, mode)}
+    return {s[len(CHANNEL_PREFIX):]: build_policy(config, mode, config[s]) for s in sections}
+
+
+def load_channels(store, cpu_sensors, backend="gpio", pin=None, root="/", clock=None):
+    # FanChannels from the [Fan:<name>] sections of pwm.config, e.g.
+    #   [Fan:soc]
+    #   Pin = 14
+    #   [Fan:nvme]
+    #   Backend = sysfs
+    #   Chip = 0
+    #   Channel = 1
+    #   Frequency = 25000
+    #   Sensor = nvme
+    #   Points = 40:20, 55:60, 70:100
+    # Sensor names a thermal zone type or hwmon device and defaults to the
+    # SoC; the tach keys are described in tach.load_tach, and Frequency,
+    # Resolution, SlewRate and Dwell default to the [Output] section.
+    # Without any such section there is one fan on [Settings] FanPin, with
+    # the tach keys in an optional [Tach] section.
+    config = store.config
+    mode = store.settings.control_mode
+    sections = channel_sections(config)
+    if not sections:
+        fan, output = create_output(backend, output_settings(config), clock,
+                                    pin=pin if pin is not None else store.settings.fan_pin)
+        tach, monitor = load_tach(config["Tach"] if config.has_section("Tach") else {}, backend, fan, clock, root)
+        return [FanChannel("fan", fan, cpu_sensors, build_policy(config, mode), tach, monitor, output)]
+
+    zones = {}
+    channels = []
+    for s in sections:
+        section = config[s]
+        kind = section.get("Backend", backend)
+        fan, output = create_output(kind, output_settings(config, section), clock,
+                                    pin=section.getint("Pin", store.settings.fan_pin),
+                                    chip=section.getint("Chip", 0), channel=section.getint("Channel", 0))
+        sensor = section.get("Sensor")
+        if sensor is None:
+            sensors = cpu_sensors
+        else:
+            # Channels naming the same zone share one open sensor
+            if sensor not in zones:
+                zones[sensor] = ZoneSensor(sensor, root)
+            sensors = zones[sensor]
+        tach, monitor = load_tach(section, kind, fan, clock, root)
+        channels.append(FanChannel(s[len(CHANNEL_PREFIX):], fan, sensors,
+                                   build_policy(config, mode, section), tach, monitor, output))
+    return channels
@@ -0,0 +1,78 @@
+#!/usr/bin/python3
+
+import time
+import asyncio
+import selectors
+
+
+class Clock:
+    # Wall-clock time for running on the Pi
+    def now(self):
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+class SimulatedClock:
+    # Virtual time for running control loops off-Pi. Sleeping advances the
+    # virtual time at once and only blocks for seconds / speed of real time,
+    # so speed=1000 runs an hour of control in 3.6 s and speed=inf doesn't
+    # block at all.
+    def __init__(self, speed=float("inf"), start=0.0):
+        self.speed = speed
+        self.time = start
+
+    def now(self):
+        return self.time
+
+    def sleep(self, seconds):
+        if seconds <= 0:
+            return
+        self.time += seconds
+        if self.speed != float("inf"):
+            time.sleep(seconds / self.speed)
+
+
+class _VirtualSelector(selectors.BaseSelector):
+    # Wraps a real selector; when the event loop would block waiting for its
+    # next timer, advance the simulated clock instead
+    def __init__(self, clock):
+        self.clock = clock
+        self.selector = selectors.DefaultSelector()
+
+    def register(self, fileobj, events, data=None):
+        return self.selector.register(fileobj, events, data)
+
+    def unregister(self, fileobj):
+        return self.selector.unregister(fileobj)
+
+    def modify(self, fileobj, events, data=None):
+        return self.selector.modify(fileobj, events, data)
+
+    def select(self, timeout=None):
+        ready = self.selector.select(0)
+        if ready or timeout == 0:
+            return ready
+        if timeout is None:
+            # Nothing scheduled: only real I/O can wake the loop
+            return self.selector.select(None)
+        self.clock.sleep(timeout)
+        return []
+
+    def close(self):
+        self.selector.close()
+
+    def get_map(self):
+        return self.selector.get_map()
+
+
+class SimulatedEventLoop(asyncio.SelectorEventLoop):
+    # asyncio loop whose timers run on a SimulatedClock: asyncio.sleep() and
+    # wait_for() timeouts cost no real time (or 1/speed of it)
+    def __init__(self, clock):
+        super().__init__(_VirtualSelector(clock))
+        self.clock = clock
+
+    def time(self):
+        return self.clock.now()
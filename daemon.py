@@ -1,145 +1,448 @@
 #!/usr/bin/python3
 
-import RPi.GPIO as GPIO
+import sys
 import time
-import subprocess
 import logging
-import psutil
 import atexit
 import signal
-import sys
+import asyncio
+import argparse
 
-# GPIO setup
-GPIO.setmode(GPIO.BCM)
-GPIO.setwarnings(False)
-GPIO.setup(14, GPIO.OUT)
-pwm = GPIO.PWM(14, 100)
+from sensors import CPUSensors, FREQ_CAPPED, THROTTLED, SOFT_TEMP_LIMIT, describe_throttle
+from clock import Clock
+from channels import FanChannel, load_channels, build_policies, policy_config
+from selftest import CACHE_PATH, SelfTestCache, self_test
+from settings import ConfigStore
+from ipc import FanServer, SOCKET_PATH, SOCKET_GROUP, lock_socket
+from telemetry import TelemetryBuffer, TelemetryLog
 
 # Logging configuration
 # Set up logging to syslog
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-logger.info("\nPress Ctrl+C to quit \n")
+# get_throttled bits that send the SoC's fans to 100 % at once. Under-voltage
+# alone doesn't: a fan at full draws more from a supply already sagging.
+FULL_FAN_BITS = FREQ_CAPPED | THROTTLED | SOFT_TEMP_LIMIT
+
+def cpu_percent():
+    # psutil is imported on the first sample, after the fans are running
+    import psutil
+    return psutil.cpu_percent()
+
+
+class FanController:
+    # Three tasks joined by events: sample() polls the sensors and wakes
+    # control() only when a reading changed; control() asks each channel's
+    # policy (a fancurve.FanPolicy, pid.PIDController or
+    # predict.PredictivePolicy) for a target duty, given the readings and
+    # the duty the fan is at, and wakes ramp() only when a target changed;
+    # ramp() steps each fan's output stage toward its target at the stage's
+    # slew rate and dwell, and restarts from the current duty whenever a
+    # new target arrives mid-ramp. Nothing but the sampler wakes in steady
+    # state.
+    # Every sample goes to the telemetry buffer and to each of `listeners`
+    # (e.g. the IPC server); the text log only hears about target changes.
+    # An override, when set, replaces the policy's target. With `metrics`
+    # (a metrics.Metrics) each sensor read and each pass of the three stages
+    # is timed into it; without, nothing is timed.
+    #
+    # `channels` (see channels.py) drives several fans from one tick: each
+    # distinct zone sensor is read once, frequency and load once for all,
+    # and every fan that needs a step is written in the same pass. Without
+    # it there is one channel made of `fan`, `sensors` and `policy`, and the
+    # duty/target/override/inputs/policy attributes refer to the first
+    # channel either way. `sensors` supplies the CPU frequency.
+    #
+    # If `sensors` can report the firmware's throttle state (throttled(),
+    # see sensors.py), it is read every tick and goes to the telemetry with
+    # each sample. While the clock is capped, throttled or held at the soft
+    # temperature limit, every fan cooling the SoC (the channels reading
+    # `sensors`) is written 100 % at once, past its slew limit.
+    def __init__(self, fan=None, sensors=None, load=None, sample_interval=1.0,
+                 policy=None, telemetry=None, wall_time=time.time, channels=None):
+        if channels is None:
+            channels = [FanChannel("fan", fan, sensors, policy)]
+        self.channels = channels
+        self.sensors = sensors if sensors is not None else channels[0].sensors
+        self.load = load
+        self.sample_interval = sample_interval
+        self.telemetry = telemetry
+        self.wall_time = wall_time
+        self.metrics = None
+        self.read_throttle = getattr(self.sensors, "throttled", None)
+        self.throttled = 0          # live get_throttled bits
+        self.throttle_events = 0    # times a throttle bit came on
+
+        self.listeners = []
+
+        self.reading_changed = asyncio.Event()
+        self.target_changed = asyncio.Event()
+
+    def channel(self, name):
+        for channel in self.channels:
+            if channel.name == name:
+                return channel
+        raise KeyError(f"No fan channel named {name}")
+
+    # The single-fan view used by the GUI state and the benches
+    fan = property(lambda self: self.channels[0].fan)
+    inputs = property(lambda self: self.channels[0].inputs)
+    target = property(lambda self: self.channels[0].target)
+    override = property(lambda self: self.channels[0].override)
+
+    @property
+    def duty(self):
+        return self.channels[0].duty
+
+    @duty.setter
+    def duty(self, duty):
+        for channel in self.channels:
+            channel.duty = duty
+
+    @property
+    def policy(self):
+        return self.channels[0].policy
+
+    @policy.setter
+    def policy(self, policy):
+        self.channels[0].policy = policy
+
+    def prime(self):
+        # Start each fan at the duty its policy picks for one temperature
+        # reading, before the tasks run, rather than at 0 % while the first
+        # ramp catches up
+        temps = {}
+        for channel in self.channels:
+            key = id(channel.sensors)
+            if key not in temps:
+                temps[key] = channel.sensors.temperature()
+            channel.output.setup(channel.policy(temp=temps[key], duty=0))
+
+    def read(self, sensor, read):
+        if self.metrics is None:
+            return read()
+        start = time.perf_counter()
+        value = read()
+        self.metrics.observe_read(sensor, time.perf_counter() - start)
+        return value
+
+    def timed(self, stage, start):
+        if self.metrics is not None:
+            self.metrics.observe_stage(stage, time.perf_counter() - start)
+
+    async def sample(self):
+        while True:
+            start = time.perf_counter()
+            shared = {"freq": self.read("frequency", self.sensors.frequency) / 1000000}
+            if self.load is not None:
+                try:
+                    shared["load"] = self.read("load", self.load)
+                except ImportError as e:
+                    # psutil missing: carry on with temperature and frequency
+                    logger.warning(f"No CPU load readings ({e}); load curves are off")
+                    self.load = None
+            changed = False
+            if self.read_throttle is not None:
+                throttled = self.read("throttle", self.read_throttle)
+                if throttled != self.throttled:
+                    self.note_throttle(throttled)
+                    changed = True
+            temps = {}
+            for channel in self.channels:
+                key = id(channel.sensors)
+                if key not in temps:
+                    temps[key] = self.read(f"temperature:{channel.name}", channel.sensors.temperature)
+                inputs = {"temp": temps[key], **shared}
+                if inputs != channel.inputs:
+                    channel.inputs = inputs
+                    changed = True
+            if self.telemetry is not None:
+                # The log holds one fan; with several it is the first channel
+                first = self.channels[0]
+                self.telemetry.append(self.wall_time(), first.inputs["temp"], shared["freq"],
+                                      shared.get("load", 0.0), first.duty, self.throttled)
+            # PID and predictive policies keep time (they have a `now`): their
+            # integral, rate limit and model advance per tick, so they run
+            # every tick whether or not a reading changed
+            if changed or any(hasattr(c.policy, "now") for c in self.channels):
+                self.reading_changed.set()
+            self.check_fans()
+            self.timed("sample", start)
+            for listener in self.listeners:
+                listener(self)
+            await asyncio.sleep(self.sample_interval)
+
+    def note_throttle(self, throttled):
+        if throttled & ~self.throttled:
+            self.throttle_events += 1
+            action = "; fans to 100%" if throttled & FULL_FAN_BITS else ""
+            logger.warning(f"CPU throttling: {describe_throttle(throttled)}{action}")
+        elif not throttled:
+            logger.info("CPU throttling ended")
+        self.throttled = throttled
+
+    def check_fans(self):
+        # Fan Failure Detection: measured RPM against the commanded duty
+        now = asyncio.get_running_loop().time()
+        for channel in self.channels:
+            if channel.tach is None:
+                continue
+            channel.rpm = self.read(f"tach:{channel.name}", channel.tach.rpm)
+            status = channel.monitor.check(now, channel.duty, channel.rpm)
+            if status == channel.fault:
+                continue
+            expected = channel.monitor.model.expected(channel.duty)
+            if status == "stalled":
+                logger.warning(f"Fan failure detected! Fan {channel.name} is at {channel.rpm:.0f} RPM, "
+                               f"expected {expected:.0f} at {channel.duty:.0f}%. Check the fan.")
+            elif status == "degraded":
+                logger.warning(f"Fan {channel.name} is degraded: {channel.rpm:.0f} RPM, "
+                               f"expected {expected:.0f} at {channel.duty:.0f}%")
+            elif channel.fault in ("stalled", "degraded"):
+                logger.info(f"Fan {channel.name} recovered: {channel.rpm:.0f} RPM")
+            channel.fault = status
+
+    def set_override(self, duty, channel=None):
+        # Hold the fan named `channel` (all fans by default) at `duty` %, or
+        # resume the policy with None
+        for c in self.channels if channel is None else [self.channel(channel)]:
+            c.override = duty
+        self.reading_changed.set()
+
+    async def control(self):
+        while True:
+            await self.reading_changed.wait()
+            self.reading_changed.clear()
+
+            start = time.perf_counter()
+            full = self.throttled & FULL_FAN_BITS
+            for channel in self.channels:
+                inputs = channel.inputs
+                if inputs is None:
+                    continue
+                dc = channel.policy(duty=channel.duty, **inputs)
+                if channel.override is not None:
+                    dc = channel.override
+                forced = full and channel.sensors is self.sensors
+                if forced:
+                    dc = 100
+                    if channel.duty != dc:
+                        channel.output.set_duty(dc)  # at once, past the slew limit
+
+                if dc != channel.target:
+                    channel.target = dc
+                    self.target_changed.set()
+
+                # PID and predictive targets move a little nearly every tick;
+                # log only what reaches the fan at the output stage's
+                # resolution, or a change in what decides the duty
+                logged = (channel.output.quantize(dc), channel.override, forced, channel.policy)
+                if logged != channel.logged:
+                    channel.logged = logged
+                    name = "" if len(self.channels) == 1 else f"{channel.name} "
+                    logger.info(f"Fan {name}target {dc:.0f}% (Temp is: {inputs['temp']}°C, "
+                                f"Load is: {inputs.get('load', 0.0)}%)")
+            self.timed("decide", start)
+
+    async def ramp(self):
+        loop = asyncio.get_running_loop()
+        woke = 0.0
+        while True:
+            # One pass writes every fan that is due a step; the output stage
+            # says when each one is due next. A timer may fire a hair before
+            # its deadline, so a timeout counts as reaching it.
+            now = max(loop.time(), woke)
+            start = time.perf_counter()
+            wake = None
+            for channel in self.channels:
+                if channel.target is None:
+                    continue
+                due = channel.output.step(channel.target, now)
+                if due is not None:
+                    wake = due if wake is None else min(wake, due)
+            self.timed("actuate", start)
 
-# Initializations
-dc = 0
-current_dc = 0
-pwm.start(dc)
+            if wake is None:
+                await self.target_changed.wait()
+            else:
+                try:
+                    await asyncio.wait_for(self.target_changed.wait(), wake - now)
+                except asyncio.TimeoutError:
+                    woke = wake
+            self.target_changed.clear()
 
-# Temperature thresholds and hysteresis
-temp_threshold_high = 45
-temp_threshold_medium = 40
-temp_threshold_low_1 = 35
-temp_threshold_low_2 = 30
-hysteresis = 2
+    async def run(self):
+        await asyncio.gather(self.sample(), self.control(), self.ramp())
 
-# Function to clean up GPIO and turn off the fan
-def cleanup(signum=None, frame=None):
+
+async def ramp_down(channels):
+    # Fan speed ramp-down, all fans together
+    start = [int(channel.duty) for channel in channels]
+    for step in range(0, max(start, default=0), 5):
+        for channel, duty in zip(channels, start):
+            if duty - step > 0:
+                channel.output.set_duty(duty - step)
+        await asyncio.sleep(1.0)
+
+
+async def run(controller, server, testing, cache):
+    try:
+        await server.start()
+        if testing:
+            results = await self_test(testing)
+            for channel in testing:
+                passed, rpm = results[channel.name]
+                if passed is not None:
+                    cache.record(channel, passed, rpm)
+            cache.save()
+        await controller.run()
+    except asyncio.CancelledError:
+        await ramp_down(controller.channels)
+
+        # Log and logger.info exit message
+        logging.info("Ctrl + C pressed -- Ending program")
+        logger.info("Ctrl + C pressed -- Ending program")
+    finally:
+        await server.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Temperature-controlled PWM fan daemon")
+    parser.add_argument("--backend", choices=["gpio", "sysfs", "sim"], default="gpio")
+    parser.add_argument("--pin", type=int,
+                        help="BCM pin for the gpio backend when the config has no [Fan:*] sections "
+                             "(default: FanPin in the config)")
+    parser.add_argument("--interval", type=float, default=1.0,
+                        help="seconds between temperature samples")
+    parser.add_argument("--self-test", choices=["auto", "always", "never"], default="auto",
+                        help="spin the fans up and check their tach at startup: auto runs it for "
+                             "fans with a tach that haven't passed within a week")
+    parser.add_argument("--self-test-cache", default=CACHE_PATH, help="last self-test results")
+    parser.add_argument("--skip-dry-run", dest="self_test", action="store_const", const="never",
+                        help=argparse.SUPPRESS)  # the dry run it skipped is gone
+    parser.add_argument("--root", default="/", help=argparse.SUPPRESS)  # fake /sys for bench.py
+    parser.add_argument("--config", default="pwm.config", help="fan curves are read from here")
+    parser.add_argument("--socket", default=SOCKET_PATH, help="Unix socket for pwm.py and max.py")
+    parser.add_argument("--socket-group", default=SOCKET_GROUP,
+                        help="group that may use the socket besides root; empty for owner only")
+    parser.add_argument("--telemetry", default="fan_telemetry.bin",
+                        help="binary sample log, read with telemetry.py; empty to disable")
+    parser.add_argument("--metrics-port", type=int,
+                        help="serve Prometheus metrics on this localhost port (default: off)")
+    parser.add_argument("--metrics-host", default="127.0.0.1")
+    args = parser.parse_args()
+
+    # One daemon per socket: claim it before any fan is set up
+    try:
+        lock = lock_socket(args.socket)
+    except (RuntimeError, OSError) as e:
+        logger.error(f"Not starting: {e}")
+        return 1
+
+    store = ConfigStore(args.config)
+
+    # Sensors are opened once and re-read every sample
+    sensors = CPUSensors(root=args.root)
+    channels = load_channels(store, sensors, args.backend, args.pin, args.root,
+                             clock=Clock() if args.backend == "sim" else None)
+    controller = FanController(sensors=sensors, load=cpu_percent, sample_interval=args.interval,
+                               channels=channels)
+    controller.prime()
+    logger.info("Fans started at " + ", ".join(f"{c.name} {c.duty:.0f}%" for c in channels))
+    for channel in channels:
+        if channel.tach is not None:
+            channel.tach.setup()
+
+    telemetry = TelemetryBuffer(log=TelemetryLog(args.telemetry)) if args.telemetry else None
+    controller.telemetry = telemetry
+
+    exporter = None
+    if args.metrics_port is not None:
+        from metrics import Metrics, MetricsServer
+        controller.metrics = Metrics()
+        exporter = MetricsServer(controller, controller.metrics, args.metrics_host, args.metrics_port)
+        exporter.start()
+
+    cache = SelfTestCache(args.self_test_cache)
+    if args.self_test == "always":
+        testing = channels
+    elif args.self_test == "auto":
+        testing = [channel for channel in channels if cache.due(channel)]
+    else:
+        testing = []
+
+    logger.info("\nPress Ctrl+C to quit \n")
+
+    # Function to clean up GPIO and turn off the fans
+    def cleanup():
+        try:
+            for channel in channels:
+                channel.output.set_duty(0)  # Set fan speed to 0
+            time.sleep(1.0)  # Wait for the fans to stop
+            for channel in channels:
+                if channel.tach is not None:
+                    channel.tach.close()
+                channel.fan.stop()
+            for channel in channels:
+                channel.fan.cleanup()
+            for zone in {id(c.sensors): c.sensors for c in channels}.values():
+                if zone is not sensors:
+                    zone.close()
+            sensors.close()
+            store.close()
+            if exporter is not None:
+                exporter.close()
+            if telemetry is not None:
+                telemetry.close()
+            for channel in channels:
+                logger.info(f"Fan {channel.name}: {channel.output.issued} PWM writes issued, "
+                            f"{channel.output.suppressed} suppressed")
+            logging.info("Program terminated -- Cleaning up GPIO")
+            logger.info("Fan turned off. Exiting program.")
+        except Exception as e:
+            logger.info(f"An error occurred during cleanup: {str(e)}")
+
+    # Clean up on exit; SIGINT and SIGTERM cancel the controller first
+    atexit.register(cleanup)
+
+    loop = asyncio.new_event_loop()
+
+    # Pick up curve and PID edits (from the GUI or by hand) without a restart.
+    # Adding or removing [Fan:*] sections needs one, since fans are claimed
+    # at startup. Policies are only rebuilt, losing their PID, hysteresis and
+    # model state, when something they are built from changed.
+    built = [policy_config(store)]
+
+    def apply(policies):
+        for channel in channels:
+            if channel.name in policies:
+                channel.policy = policies[channel.name]
+        if set(policies) != {channel.name for channel in channels}:
+            logger.info("Fan channels changed in the config; restart to apply")
+        controller.reading_changed.set()
+
+    def reload(store):
+        current = policy_config(store)
+        if current == built[0]:
+            return
+        built[0] = current
+        loop.call_soon_threadsafe(apply, build_policies(store))
+    store.watch(reload)
+
+    server = FanServer(controller, args.socket, args.socket_group, lock)
+    task = loop.create_task(run(controller, server, testing, cache))
+    loop.add_signal_handler(signal.SIGINT, task.cancel)
+    loop.add_signal_handler(signal.SIGTERM, task.cancel)
     try:
-        pwm.ChangeDutyCycle(0)  # Set fan speed to 0
-        time.sleep(1.0)  # Wait for the fan to stop
-        pwm.stop()
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setup(14, GPIO.OUT)
-        GPIO.output(14, GPIO.LOW)
-        GPIO.cleanup()
-        logging.info("Program terminated -- Cleaning up GPIO")
-        logger.info("Fan turned off. Exiting program.")
+        loop.run_until_complete(task)
     except Exception as e:
-        logger.info(f"An error occurred during cleanup: {str(e)}")
-    sys.exit(0)
-
-# Register the cleanup function to be called on exit, SIGINT, and SIGTERM
-atexit.register(cleanup)
-signal.signal(signal.SIGINT, cleanup)
-signal.signal(signal.SIGTERM, cleanup)
-
-# Dry run at 0% speed for 30 seconds
-logger.info("FAN IS RUNNING AT 0% speed for 30 seconds.. (DRY RUN 1)")
-start_time = time.time()
-while time.time() - start_time < 30.0:
-    pwm.ChangeDutyCycle(0)
-    time.sleep(1.0)
-
-# Fan speed ramp-up from 0 to 100 over 100 seconds
-logger.info("FAN SPEED IS INCREASING FROM 0 TO 100% over 100 seconds.. (DRY RUN 2)")
-start_time = time.time()
-while time.time() - start_time < 100.0:
-    dc += 1
-    pwm.ChangeDutyCycle(dc)
-    time.sleep(1.0)
-
-# Full-speed run at 100% for 60 seconds
-logger.info("FAN IS RUNNING AT 100% speed for 60 seconds.. (DRY RUN 3)")
-start_time = time.time()
-while time.time() - start_time < 60.0:
-    pwm.ChangeDutyCycle(100)
-    time.sleep(1.0)
-
-try:
-    while True:
-        # Get CPU temperature
-        temp = subprocess.getoutput("vcgencmd measure_temp|sed 's/[^0-9.]//g'")
-        
-        # Temperature control logic with hysteresis
-        if round(float(temp)) >= temp_threshold_high + hysteresis:
-            dc = 100
-        elif round(float(temp)) >= temp_threshold_medium + hysteresis:
-            dc = 85
-        elif round(float(temp)) >= temp_threshold_low_1 + hysteresis:
-            dc = 75
-        elif round(float(temp)) >= temp_threshold_low_2 + hysteresis:
-            dc = 60
-        else:
-            dc = 40
-
-        # Fan speed ramp-up
-        log_message = f"FAN IS RUNNING AT {dc}% speed, TEMPERATURE IS {float(temp)}°C"
-        logger.info(log_message)
-        sys.stdout.write(log_message + '\n')
-        sys.stdout.flush()
-
-        for current_dc in range(current_dc, dc + 1, 5):
-            pwm.ChangeDutyCycle(current_dc)
-            time.sleep(1.0)
-
-        # Log temperature, fan duty cycle, system load
-        system_load = psutil.cpu_percent()
-        log_entry = (
-            f"CPU Temp is: {float(temp)}°C, Fan speed is: {dc}%, Load is: {system_load}%"
-        )
-        logging.info(log_entry)
-
-        # Fan Failure Detection
-        if dc == 0:
-            logger.info("Fan failure detected! Check the fan.")
-            # Take corrective action, e.g., turn off the system or send an alert
-
-        # Dynamic Fan Control based on system load
-        if system_load > 80:
-            dc = 100
-        elif system_load > 60:
-            dc = 85
-        elif system_load > 40:
-            dc = 75
-        else:
-            dc = 40
-
-        # Sleep for a specific duration
-        time.sleep(60.0)
-
-except KeyboardInterrupt:
-    # Fan speed ramp-down
-    for current_dc in range(current_dc, 0, -5):
-        pwm.ChangeDutyCycle(current_dc)
-        time.sleep(1.0)
-
-    cleanup()  # Clean up GPIO on keyboard interrupt
-
-    # Log and logger.info exit message
-    logging.info("Ctrl + C pressed -- Ending program")
-    logger.info("Ctrl + C pressed -- Ending program")
-except Exception as e:
-    logger.info(f"An error occurred: {str(e)}")
-    cleanup()  # Clean up GPIO on error
+        logger.info(f"An error occurred: {str(e)}")
+    finally:
+        atexit.unregister(cleanup)
+        cleanup()  # Clean up GPIO on exit or error
+        loop.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
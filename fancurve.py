@@ -0,0 +1,168 @@
+#!/usr/bin/python3
+
+from array import array
+from bisect import bisect_right
+
+# numpy is only used for batch evaluation and costs more to import than the
+# rest of the daemon together, so it is loaded by numpy() on first use
+np = False
+
+
+def numpy():
+    global np
+    if np is False:
+        try:
+            import numpy as np
+        except ImportError:
+            np = None
+    return np
+
+# daemon.py's 30/35/40/45 °C ladder with its 2 °C band, as step curves
+DEFAULT_TEMP_POINTS = [(0, 40), (32, 60), (37, 75), (42, 85), (47, 100)]
+DEFAULT_TEMP_HYSTERESIS = 2.0
+# daemon.py's load ladder (above 40/60/80 %), which it used to compute and
+# then discard; psutil reports load to 0.1 %
+DEFAULT_LOAD_POINTS = [(0, 40), (40.1, 75), (60.1, 85), (80.1, 100)]
+
+# Config section and lookup-table resolution for each input
+INPUTS = {
+    "temp": ("Curve", 0.1),
+    "load": ("LoadCurve", 0.1),
+    "freq": ("FreqCurve", 1.0),   # MHz
+}
+
+
+def parse_points(text):
+    # "32:60, 37:75" -> [(32.0, 60.0), (37.0, 75.0)]
+    points = []
+    for item in text.split(","):
+        x, _, duty = item.strip().partition(":")
+        points.append((float(x), float(duty)))
+    return sorted(points)
+
+
+class FanCurve:
+    # Maps one input to a duty cycle through a step or piecewise-linear curve.
+    # The curve is sampled once into a lookup table at `resolution`, so
+    # evaluating is an index computation whatever the number of points.
+    def __init__(self, points, mode="linear", hysteresis=0.0, resolution=0.1):
+        if mode not in ("linear", "step"):
+            raise ValueError(f"Unknown curve mode: {mode}")
+        self.points = sorted(points)
+        self.xs = [p[0] for p in self.points]
+        self.mode = mode
+        self.hysteresis = hysteresis
+        self.resolution = resolution
+
+        self.low = self.points[0][0]
+        size = int(round((self.points[-1][0] - self.low) / resolution)) + 1
+        self.table = array("d", (self.exact(self.low + i * resolution) for i in range(size)))
+        self.np_table = None
+
+        # Duty last returned by update(), for hysteresis
+        self.duty = None
+
+    def exact(self, x):
+        # Evaluate the curve from its points; used to build the table
+        i = bisect_right(self.xs, x + 1e-9)
+        if i == 0:
+            return self.points[0][1]
+        if i == len(self.points) or self.mode == "step":
+            return self.points[i - 1][1]
+        (x0, y0), (x1, y1) = self.points[i - 1], self.points[i]
+        return y0 + (y1 - y0) * (x - x0) / (x1 - x0)
+
+    def __call__(self, x):
+        i = int((x - self.low) / self.resolution + 1e-9)
+        if i < 0:
+            i = 0
+        elif i >= len(self.table):
+            i = len(self.table) - 1
+        return self.table[i]
+
+    def evaluate(self, xs):
+        # Stateless batch evaluation of a sequence or array of inputs
+        np = numpy()
+        if np is not None:
+            if self.np_table is None:
+                self.np_table = np.frombuffer(self.table, dtype=np.float64)
+            i = np.floor((np.asarray(xs, dtype=np.float64) - self.low) / self.resolution + 1e-9)
+            return self.np_table[np.clip(i, 0, len(self.table) - 1).astype(np.intp)]
+        return array("d", map(self, xs))
+
+    def update(self, x):
+        # Stateful evaluation with a hysteresis band: rising inputs follow the
+        # curve, falling inputs follow it shifted down by `hysteresis`, and the
+        # duty holds anywhere in between
+        rising = self(x)
+        if self.duty is None or rising > self.duty:
+            self.duty = rising
+        else:
+            falling = self(x + self.hysteresis)
+            if falling < self.duty:
+                self.duty = falling
+        return self.duty
+
+    def replay(self, xs):
+        # update() over a sequence, starting from a fresh hysteresis state
+        self.duty = None
+        return array("d", map(self.update, xs))
+
+
+class FanPolicy:
+    # Combines one curve per input (temp, load, freq) by taking the maximum
+    def __init__(self, curves):
+        self.curves = curves
+
+    def __call__(self, **inputs):
+        duty = 0.0
+        for name, curve in self.curves.items():
+            value = inputs.get(name)
+            if value is not None:
+                duty = max(duty, curve.update(value))
+        return duty
+
+    def evaluate(self, **series):
+        # Stateless batch evaluation; each keyword is an array of one input
+        result = None
+        for name, curve in self.curves.items():
+            if name not in series:
+                continue
+            duty = curve.evaluate(series[name])
+            if result is None:
+                result = duty
+            elif numpy() is not None:
+                result = np.maximum(result, duty)
+            else:
+                result = array("d", map(max, result, duty))
+        return result
+
+
+def curve_from_section(section, resolution):
+    return FanCurve(parse_points(section["Points"]),
+                    mode=section.get("Mode", "linear"),
+                    hysteresis=section.getfloat("Hysteresis", 0.0),
+                    resolution=section.getfloat("Resolution", resolution))
+
+
+def default_policy():
+    return FanPolicy({
+        "temp": FanCurve(DEFAULT_TEMP_POINTS, "step", DEFAULT_TEMP_HYSTERESIS),
+        "load": FanCurve(DEFAULT_LOAD_POINTS, "step"),
+    })
+
+
+def load_policy(config, fallback=default_policy):
+    # Build a FanPolicy from the [Curve], [LoadCurve] and [FreqCurve] sections
+    # of pwm.config, e.g.
+    #   [Curve]
+    #   Mode = linear
+    #   Points = 35:30, 50:70, 65:100
+    #   Hysteresis = 2
+    curves = {}
+    for name, (section, resolution) in INPUTS.items():
+        if config.has_section(section):
+            curves[name] = curve_from_section(config[section], resolution)
+    if not curves:
+        return fallback()
+    return FanPolicy(curves)
@@ -0,0 +1,237 @@
+#!/usr/bin/python3
+
+# Local API of the fan daemon: newline-delimited JSON over a Unix socket.
+#   {"cmd": "state"}                  -> one state object
+#   {"cmd": "subscribe"}              -> {"ok": true}, then a state object per sample
+#   {"cmd": "override", "duty": 100}  -> hold the fan at 100 % while this
+#                                        connection stays open
+#   {"cmd": "override", "duty": null} -> release the holds this connection
+#                                        has, back to automatic control
+#   {"cmd": "override", "duty": 100, "channel": "nvme"}
+#                                     -> the same for one fan of several
+# A hold on a fan another connection is holding is refused with an error
+# until that connection releases it or goes away.
+# A state object has time, temp, freq, load, duty, target, override, rpm
+# and fault for the first fan, throttled and throttle_events, and a
+# "channels" list with name, temp, duty, target, override, rpm, fault,
+# writes and suppressed for every fan. rpm and fault are null for a fan
+# without a tach; writes and suppressed count the PWM writes the fan's
+# output stage passed on and dropped. throttled holds the live
+# get_throttled bits (see sensors.py) and throttle_events counts the times
+# one of them came on.
+
+import os
+import grp
+import fcntl
+import json
+import socket
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+SOCKET_PATH = "/run/pwm-fan.sock"
+
+# Group allowed to use the socket besides its owner. Driving the fan needed
+# GPIO access before the daemon owned it, so it still does.
+SOCKET_GROUP = "gpio"
+
+# Held by the daemon serving a socket, next to it
+LOCK_SUFFIX = ".lock"
+
+# Bytes allowed to queue for a subscriber before it starts missing samples
+SUBSCRIBER_BACKLOG = 64 * 1024
+
+
+def lock_socket(path):
+    # Claim `path` for this process before it touches a fan: an exclusive
+    # flock on path.lock, which the kernel drops if we die. Returns the
+    # lock's fd; raises RuntimeError while another daemon holds it.
+    fd = os.open(path + LOCK_SUFFIX, os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        raise RuntimeError(f"Another fan daemon is serving {path}") from None
+    return fd
+
+
+class FanServer:
+    # Serves a FanController. Each sample is encoded once and the same bytes
+    # are written to every subscriber; a subscriber that isn't reading skips
+    # samples instead of holding up the controller or the others.
+    def __init__(self, controller, path=SOCKET_PATH, group=SOCKET_GROUP, lock=None):
+        self.controller = controller
+        self.path = path
+        self.group = group
+        self.lock = lock  # from lock_socket(path), taken by start() if None
+        self.inode = None  # of the socket file we bound
+        self.subscribers = set()
+        self.connections = {}  # handler task -> its writer
+        self.override_owners = {}  # channel name or None (all fans) -> writer
+        self.server = None
+        self.dropped = 0
+        controller.listeners.append(self.publish)
+
+    async def start(self):
+        if self.lock is None:
+            self.lock = lock_socket(self.path)
+        # With the lock held, a socket file left behind is a dead daemon's
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        # Created owner and group only, so no one else can connect even
+        # before the group is set
+        umask = os.umask(0o117)
+        try:
+            self.server = await asyncio.start_unix_server(self.handle, self.path)
+        finally:
+            os.umask(umask)
+        self.inode = os.stat(self.path).st_ino
+        if self.group:
+            try:
+                os.chown(self.path, -1, grp.getgrnam(self.group).gr_gid)
+            except KeyError:
+                logger.warning(f"No group {self.group}; only {os.getuid()} can use {self.path}")
+        logger.info(f"Listening on {self.path}")
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            # Closing the transports ends each handler's read loop
+            for writer in self.connections.values():
+                writer.close()
+            await asyncio.gather(*self.connections, return_exceptions=True)
+            await self.server.wait_closed()
+            self.server = None
+            # Only remove the socket if it is still the one we bound
+            try:
+                if os.stat(self.path).st_ino == self.inode:
+                    os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+        if self.lock is not None:
+            os.close(self.lock)
+            self.lock = None
+
+    def state(self):
+        c = self.controller
+        inputs = c.inputs or {}
+        return {"time": c.wall_time(), "temp": inputs.get("temp"), "freq": inputs.get("freq"),
+                "load": inputs.get("load"), "duty": c.duty, "target": c.target,
+                "override": c.override, "rpm": c.channels[0].rpm, "fault": c.channels[0].fault,
+                "throttled": c.throttled, "throttle_events": c.throttle_events,
+                "channels": [{"name": ch.name, "temp": (ch.inputs or {}).get("temp"), "duty": ch.duty,
+                              "target": ch.target, "override": ch.override, "rpm": ch.rpm,
+                              "fault": ch.fault, "writes": ch.output.issued,
+                              "suppressed": ch.output.suppressed} for ch in c.channels]}
+
+    def publish(self, controller):
+        if not self.subscribers:
+            return
+        line = encode(self.state())
+        for writer in self.subscribers:
+            if writer.transport.get_write_buffer_size() > SUBSCRIBER_BACKLOG:
+                self.dropped += 1
+                continue
+            writer.write(line)
+
+    async def handle(self, reader, writer):
+        self.connections[asyncio.current_task()] = writer
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    reply = self.dispatch(request, writer)
+                except (ValueError, KeyError, TypeError) as e:
+                    reply = {"error": str(e)}
+                writer.write(encode(reply))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.subscribers.discard(writer)
+            # Whoever forced a fan went away; resume automatic control
+            for channel in self.held_by(writer):
+                self.release(channel)
+            writer.close()
+            self.connections.pop(asyncio.current_task(), None)
+
+    def dispatch(self, request, writer):
+        cmd = request["cmd"]
+        if cmd == "state":
+            return self.state()
+        if cmd == "subscribe":
+            self.subscribers.add(writer)
+            return {"ok": True}
+        if cmd == "override":
+            duty = request.get("duty")
+            channel = request.get("channel")
+            if channel is not None:
+                self.controller.channel(channel)  # KeyError for an unknown fan
+            if duty is None:
+                for held in self.held_by(writer):
+                    if channel is None or held == channel:
+                        self.release(held)
+                return {"ok": True, "override": None}
+            # A hold on all fans overlaps every other hold
+            if any(owner is not writer and (channel is None or held in (None, channel))
+                   for held, owner in self.override_owners.items()):
+                raise ValueError("The fan is held by another client")
+            duty = min(max(float(duty), 0.0), 100.0)
+            self.controller.set_override(duty, channel)
+            self.override_owners[channel] = writer
+            return {"ok": True, "override": duty}
+        raise ValueError(f"Unknown command: {cmd}")
+
+    def held_by(self, writer):
+        return [channel for channel, owner in self.override_owners.items() if owner is writer]
+
+    def release(self, channel):
+        del self.override_owners[channel]
+        self.controller.set_override(None, channel)
+
+
+def encode(message):
+    return (json.dumps(message) + "\n").encode()
+
+
+class FanClient:
+    # Blocking client for scripts and the GUI
+    def __init__(self, path=SOCKET_PATH, timeout=None):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(path)
+        self.file = self.sock.makefile("rb")
+
+    def request(self, **message):
+        self.sock.sendall(encode(message))
+        line = self.file.readline()
+        if not line:
+            raise ConnectionError("The fan daemon closed the connection")
+        reply = json.loads(line)
+        if "error" in reply:
+            raise ValueError(reply["error"])
+        return reply
+
+    def state(self):
+        return self.request(cmd="state")
+
+    def set_override(self, duty, channel=None):
+        if channel is None:
+            return self.request(cmd="override", duty=duty)
+        return self.request(cmd="override", duty=duty, channel=channel)
+
+    def subscribe(self):
+        # Yields a state dict per daemon sample until the connection closes
+        self.request(cmd="subscribe")
+        for line in self.file:
+            message = json.loads(line)
+            if "time" in message:
+                yield message
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
@@ -0,0 +1,181 @@
+#!/usr/bin/python3
+
+# Prometheus exporter for the fan daemon: `daemon.py --metrics-port 9101`
+# serves http://127.0.0.1:9101/metrics in the Prometheus text format, or
+# OpenMetrics when the scraper asks for it. Gauges are read from the
+# controller when scraped; the controller only records into histograms,
+# a bisect and three additions per observation.
+
+import logging
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds: a pread is microseconds, a vcgencmd fork tens of
+# milliseconds
+LATENCY_BUCKETS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3,
+                   1e-2, 2.5e-2, 5e-2, 0.1, 0.25)
+
+STAGES = ("sample", "decide", "actuate")
+
+PROMETHEUS_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+OPENMETRICS_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, labels):
+        counts = list(self.counts)
+        total = 0
+        for bound, n in zip(self.buckets + (float("inf"),), counts):
+            total += n
+            yield f"{name}_bucket", {**labels, "le": format_bound(bound)}, total
+        yield f"{name}_sum", labels, self.sum
+        yield f"{name}_count", labels, total
+
+
+class Metrics:
+    # What the controller records: a read latency histogram per sensor and
+    # a duration histogram per control loop stage
+    def __init__(self):
+        self.reads = {}
+        self.stages = {stage: Histogram() for stage in STAGES}
+
+    def observe_read(self, sensor, seconds):
+        histogram = self.reads.get(sensor)
+        if histogram is None:
+            histogram = self.reads[sensor] = Histogram()
+        histogram.observe(seconds)
+
+    def observe_stage(self, stage, seconds):
+        self.stages[stage].observe(seconds)
+
+    def families(self, controller):
+        # (name, type, help, [(sample name, labels, value)]) for one scrape
+        channels = controller.channels
+        fan = lambda ch: {"fan": ch.name}
+        inputs = controller.inputs or {}
+
+        def gauge(name, help, samples):
+            return name, "gauge", help, [(name, labels, value) for labels, value in samples
+                                         if value is not None]
+
+        def counter(name, help, samples):
+            return name, "counter", help, [(f"{name}_total", labels, value) for labels, value in samples]
+
+        yield gauge("fan_temperature_celsius", "Temperature of the zone each fan cools",
+                    [(fan(ch), (ch.inputs or {}).get("temp")) for ch in channels])
+        yield gauge("fan_cpu_frequency_mhz", "ARM clock", [({}, inputs.get("freq"))])
+        yield gauge("fan_cpu_load_percent", "CPU load", [({}, inputs.get("load"))])
+        yield gauge("fan_cpu_throttled", "Live get_throttled bits: 1 under-voltage, 2 frequency capped, "
+                    "4 throttled, 8 soft temperature limit", [({}, controller.throttled)])
+        yield counter("fan_cpu_throttle_events", "Times the firmware started throttling",
+                      [({}, controller.throttle_events)])
+        yield gauge("fan_duty_percent", "Duty cycle last written to the fan",
+                    [(fan(ch), ch.duty) for ch in channels])
+        yield gauge("fan_target_duty_percent", "Duty cycle the policy or override asks for",
+                    [(fan(ch), ch.target) for ch in channels])
+        yield gauge("fan_override_percent", "Duty cycle held by a client override",
+                    [(fan(ch), ch.override) for ch in channels])
+        yield gauge("fan_rpm", "Fan speed measured by the tach",
+                    [(fan(ch), ch.rpm) for ch in channels])
+        yield gauge("fan_failed", "1 while the tach shows the fan stalled",
+                    [(fan(ch), int(ch.fault == "stalled")) for ch in channels if ch.tach is not None])
+        yield counter("fan_pwm_writes", "Duty cycle writes passed to the PWM backend",
+                      [(fan(ch), ch.output.issued) for ch in channels])
+        yield counter("fan_pwm_writes_suppressed", "Duty cycle writes dropped by the output stage",
+                      [(fan(ch), ch.output.suppressed) for ch in channels])
+        yield ("fan_sensor_read_seconds", "histogram", "Time to read one sensor",
+               [s for sensor, h in sorted(self.reads.items())
+                for s in h.samples("fan_sensor_read_seconds", {"sensor": sensor})])
+        yield ("fan_stage_seconds", "histogram", "Time spent per control loop stage",
+               [s for stage, h in self.stages.items()
+                for s in h.samples("fan_stage_seconds", {"stage": stage})])
+
+    def render(self, controller, openmetrics=False):
+        lines = []
+        for name, kind, help, samples in self.families(controller):
+            family = name if openmetrics or kind != "counter" else f"{name}_total"
+            lines.append(f"# HELP {family} {help}")
+            lines.append(f"# TYPE {family} {kind}")
+            for sample, labels, value in samples:
+                lines.append(f"{sample}{format_labels(labels)} {format_value(value)}")
+        if openmetrics:
+            lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+def format_bound(bound):
+    return "+Inf" if bound == float("inf") else repr(float(bound))
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escape = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def format_value(value):
+    if isinstance(value, bool):
+        value = int(value)
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsServer:
+    # Serves /metrics from a thread of its own, so a scrape never waits on
+    # the controller's event loop, nor the loop on a scrape
+    def __init__(self, controller, metrics, host="127.0.0.1", port=9101):
+        self.controller = controller
+        self.metrics = metrics
+        self.address = (host, port)
+        self.server = None
+        self.thread = None
+        self.scrapes = 0
+
+    def start(self):
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                openmetrics = "application/openmetrics-text" in self.headers.get("Accept", "")
+                body = exporter.metrics.render(exporter.controller, openmetrics).encode()
+                exporter.scrapes += 1
+                self.send_response(200)
+                self.send_header("Content-Type", OPENMETRICS_TYPE if openmetrics else PROMETHEUS_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # one line per scrape would flood the log
+
+        self.server = ThreadingHTTPServer(self.address, Handler)
+        self.server.daemon_threads = True
+        self.address = self.server.server_address  # the port, if 0 was asked for
+        self.thread = threading.Thread(target=self.server.serve_forever, name="metrics", daemon=True)
+        self.thread.start()
+        logger.info(f"Serving metrics on http://{self.address[0]}:{self.address[1]}/metrics")
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.thread.join()
+            self.server = None
+
@@ -0,0 +1,180 @@
+#!/usr/bin/python3
+
+import sys
+import csv
+import math
+import time
+import argparse
+
+# Defaults for the [PID] section of pwm.config
+DEFAULTS = {
+    "Target": 50.0,      # °C to hold; load bursts overshoot it by up to 9 °C
+    "Kp": 8.0,           # % duty per °C
+    "Ki": 0.05,          # % duty per °C·s
+    "Kd": 0.0,           # % duty per °C/s
+    "MinDuty": 0.0,
+    "MaxDuty": 100.0,
+    "RateLimit": 5.0,    # % duty per second, 0 for none
+}
+
+
+class PIDController:
+    # Holds the CPU at `target` °C. Called like a fan policy with the latest
+    # inputs; only `temp` is used. The integral is clamped so it can't wind up
+    # while the output is saturated, the derivative acts on the measurement so
+    # target changes don't kick the fan, and the output moves at most
+    # `rate_limit` % per second.
+    def __init__(self, target, kp, ki, kd=0.0, min_duty=0.0, max_duty=100.0,
+                 rate_limit=0.0, now=time.monotonic):
+        self.target = target
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.min_duty = min_duty
+        self.max_duty = max_duty
+        self.rate_limit = rate_limit
+        self.now = now
+        self.reset()
+
+    def reset(self):
+        self.integral = 0.0
+        self.last_time = None
+        self.last_temp = None
+        self.last_error = 0.0
+        self.duty = self.min_duty
+
+    def __call__(self, temp, **inputs):
+        now = self.now()
+        error = temp - self.target
+        if self.last_time is None:
+            dt = 0.0
+            derivative = 0.0
+        else:
+            dt = now - self.last_time
+            derivative = (temp - self.last_temp) / dt if dt > 0 else 0.0
+
+        # The reading held since the last call, so integrate the error it had
+        integral = self.integral + self.last_error * dt
+        duty = self.kp * error + self.ki * integral + self.kd * derivative
+
+        # Anti-windup: keep the new integral only if it doesn't push further
+        # into saturation
+        if duty > self.max_duty:
+            duty = self.max_duty
+            if self.last_error <= 0:
+                self.integral = integral
+        elif duty < self.min_duty:
+            duty = self.min_duty
+            if self.last_error >= 0:
+                self.integral = integral
+        else:
+            self.integral = integral
+
+        if self.rate_limit and self.last_time is not None:
+            step = self.rate_limit * dt
+            duty = min(max(duty, self.duty - step), self.duty + step)
+
+        self.duty = duty
+        self.last_time = now
+        self.last_temp = temp
+        self.last_error = error
+        return duty
+
+
+def load_pid(config, now=time.monotonic):
+    # PIDController from the [PID] section of pwm.config, e.g.
+    #   [Settings]
+    #   ControlMode = pid
+    #   [PID]
+    #   Target = 50
+    #   Kp = 8
+    #   Ki = 0.05
+    section = config["PID"] if config.has_section("PID") else {}
+    value = lambda key: float(section.get(key, DEFAULTS[key]))
+    return PIDController(value("Target"), value("Kp"), value("Ki"), value("Kd"),
+                         value("MinDuty"), value("MaxDuty"), value("RateLimit"), now)
+
+
+def solve(a, b):
+    # Gaussian elimination with partial pivoting for the small normal equations
+    n = len(b)
+    m = [row[:] + [b[i]] for i, row in enumerate(a)]
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(m[r][col]))
+        m[col], m[pivot] = m[pivot], m[col]
+        if abs(m[col][col]) < 1e-12:
+            raise ValueError("Trace does not excite the fan enough to fit a model")
+        for r in range(col + 1, n):
+            f = m[r][col] / m[col][col]
+            for c in range(col, n + 1):
+                m[r][c] -= f * m[col][c]
+    x = [0.0] * n
+    for r in reversed(range(n)):
+        x[r] = (m[r][n] - sum(m[r][c] * x[c] for c in range(r + 1, n))) / m[r][r]
+    return x
+
+
+def fit_fopdt(times, temps, duties, max_delay=30):
+    # Fit a first-order-plus-dead-time model, temp responding to duty with
+    # gain K (°C per % duty), time constant tau and delay theta (seconds), by
+    # least squares on temp[k+1] = a*temp[k] + b*duty[k-d] + c for each
+    # candidate delay d in samples and keeping the best fit.
+    dt = (times[-1] - times[0]) / (len(times) - 1)
+    best = None
+    for d in range(0, min(max_delay, len(temps) // 4) + 1):
+        rows = [(temps[k], duties[k - d], 1.0) for k in range(d, len(temps) - 1)]
+        ys = temps[d + 1:]
+        ata = [[sum(r[i] * r[j] for r in rows) for j in range(3)] for i in range(3)]
+        aty = [sum(r[i] * y for r, y in zip(rows, ys)) for i in range(3)]
+        a, b, c = solve(ata, aty)
+        residual = sum((y - (a * r[0] + b * r[1] + c)) ** 2 for r, y in zip(rows, ys))
+        if 0 < a < 1 and (best is None or residual < best[0]):
+            best = (residual, a, b, d)
+    if best is None:
+        raise ValueError("No stable first-order fit for this trace")
+    _, a, b, d = best
+    return b / (1 - a), -dt / math.log(a), d * dt
+
+
+def tune(times, temps, duties, closed_loop=None):
+    # SIMC PI tuning from a fitted model. The closed-loop time constant
+    # defaults to the dead time (a little slower if that's tiny), SIMC's
+    # setting for tight control. It says nothing about overshoot on a load
+    # burst, which comes from the plant: leave the target that much below the
+    # soft limit and check it with bench.py pid or replay.py.
+    gain, tau, delay = fit_fopdt(times, temps, duties)
+    if gain >= 0:
+        raise ValueError("Trace shows temperature rising with duty; check the fan")
+    tc = closed_loop if closed_loop is not None else max(delay, tau / 10)
+    kp = tau / (-gain * (tc + delay))
+    ti = min(tau, 4 * (tc + delay))
+    return {"Kp": kp, "Ki": kp / ti, "Kd": 0.0, "gain": gain, "tau": tau, "delay": delay}
+
+
+def read_trace(path):
+    # CSV with time (s), temp (°C) and duty (%) columns
+    times, temps, duties = [], [], []
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            times.append(float(row["time"]))
+            temps.append(float(row["temp"]))
+            duties.append(float(row["duty"]))
+    return times, temps, duties
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit PID gains from a recorded (time, temp, duty) trace")
+    parser.add_argument("trace", help="CSV file with time,temp,duty columns")
+    parser.add_argument("--closed-loop", type=float, help="desired closed-loop time constant in seconds")
+    args = parser.parse_args()
+
+    gains = tune(*read_trace(args.trace), closed_loop=args.closed_loop)
+    print(f"# model: {gains['gain']:.4f} °C/% duty, tau {gains['tau']:.1f} s, delay {gains['delay']:.1f} s")
+    print("[PID]")
+    print(f"Kp = {gains['Kp']:.4g}")
+    print(f"Ki = {gains['Ki']:.4g}")
+    print(f"Kd = {gains['Kd']:.4g}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,168 @@
+#!/usr/bin/python3
+
+import time
+import collections
+
+# Defaults for the [Predict] section of pwm.config
+DEFAULTS = {
+    "Horizon": 60.0,       # seconds ahead the fan is set for
+    "Period": 1.0,         # seconds per model step
+    "Window": 20.0,        # seconds of load history for the trend
+    "Forgetting": 0.9995,  # RLS forgetting factor per step
+    "Warmup": 60,          # model steps before predictions are trusted
+}
+
+
+class RecursiveLeastSquares:
+    # y ≈ theta · x, refitted with every sample in O(n²) for a fixed, small
+    # n. Old samples fade by `forgetting` per update; the covariance is only
+    # inflated while its trace is below `max_trace`, so a long steady spell
+    # (nothing new to learn) can't wind it up into a jumpy fit.
+    def __init__(self, n, forgetting=0.9995, initial=1000.0, max_trace=1e4):
+        self.n = n
+        self.forgetting = forgetting
+        self.max_trace = max_trace
+        self.theta = [0.0] * n
+        self.P = [[initial if i == j else 0.0 for j in range(n)] for i in range(n)]
+        self.updates = 0
+
+    def predict(self, x):
+        return sum(t * v for t, v in zip(self.theta, x))
+
+    def update(self, x, y):
+        n, P = self.n, self.P
+        Px = [sum(P[i][j] * x[j] for j in range(n)) for i in range(n)]
+        trace = sum(P[i][i] for i in range(n))
+        lam = self.forgetting if trace < self.max_trace else 1.0
+        gain = lam + sum(x[i] * Px[i] for i in range(n))
+        k = [p / gain for p in Px]
+        error = y - self.predict(x)
+        self.theta = [t + ki * error for t, ki in zip(self.theta, k)]
+        self.P = [[(P[i][j] - k[i] * Px[j]) / lam for j in range(n)] for i in range(n)]
+        self.updates += 1
+        return error
+
+
+class ThermalPredictor:
+    # First-order model of the SoC, one step per `period` seconds:
+    #   temp' = a·temp + b·work + c·duty + d
+    # where work is load scaled by the clock (load · freq / max freq seen),
+    # since the power drawn follows both. The fit is updated once per step.
+    # A `window` of recent samples gives the load trend, and forecast()
+    # projects the temperature `horizon` seconds out in closed form.
+    def __init__(self, period=1.0, window=20.0, forgetting=0.9995, warmup=60):
+        self.period = period
+        self.warmup = warmup
+        self.rls = RecursiveLeastSquares(4, forgetting)
+        self.samples = collections.deque(maxlen=max(2, int(window / period)))
+        self.max_freq = 0.0
+        self.last = None
+
+        # Running sums over the window for the least-squares load slope
+        self.sums = [0.0] * 4  # sum of k, work, k², k·work
+        self.k = 0
+
+    def regressor(self, sample):
+        temp, work, duty = sample
+        return [temp, work, duty, 1.0]
+
+    def observe(self, temp, load, freq, duty):
+        # Add one sample taken `period` seconds after the previous one
+        if freq:
+            self.max_freq = max(self.max_freq, freq)
+        work = load * freq / self.max_freq if self.max_freq else load
+        if self.last is not None:
+            self.rls.update(self.regressor(self.last), temp)
+        self.last = (temp, work, duty)
+
+        if len(self.samples) == self.samples.maxlen:
+            k0, w0 = self.samples[0]
+            self.sums[0] -= k0
+            self.sums[1] -= w0
+            self.sums[2] -= k0 * k0
+            self.sums[3] -= k0 * w0
+        self.samples.append((self.k, work))
+        self.sums[0] += self.k
+        self.sums[1] += work
+        self.sums[2] += self.k * self.k
+        self.sums[3] += self.k * work
+        self.k += 1
+
+    def trend(self):
+        # Least-squares slope of work over the window, per step
+        n = len(self.samples)
+        sk, sw, skk, skw = self.sums
+        denom = n * skk - sk * sk
+        return (n * skw - sk * sw) / denom if n > 1 and denom else 0.0
+
+    def ready(self):
+        a = self.rls.theta[0]
+        return self.rls.updates >= self.warmup and 0.0 < a < 1.0
+
+    def forecast(self, horizon, duty=None):
+        # Temperature `horizon` seconds ahead at `duty` (the current duty by
+        # default), with work following its trend, capped at 100 %
+        temp, work, current = self.last
+        steps = horizon / self.period
+        work = min(max(work + self.trend() * steps, 0.0), 100.0)
+        a, b, c, d = self.rls.theta
+        settled = (b * work + c * (current if duty is None else duty) + d) / (1.0 - a)
+        return settled + (temp - settled) * a ** steps
+
+
+class PredictivePolicy:
+    # Feed-forward wrapper around a fan curve policy: the curve sees the
+    # higher of the measured temperature and the temperature the model
+    # expects `horizon` seconds out at the present duty, so a load step
+    # spins the fan up before the heat reaches the sensor. Until the model
+    # has warmed up, or if its fit isn't stable, the curve runs on the
+    # measured temperature alone. The controller passes the fan's actual
+    # duty with the inputs.
+    def __init__(self, base, predictor, horizon=60.0, now=time.monotonic):
+        self.base = base
+        self.predictor = predictor
+        self.horizon = horizon
+        self.now = now
+        self.last_time = None
+        self.held = None
+        self.predicted = None
+
+    def observe(self, t, temp, load, freq, duty):
+        # The daemon calls once per sample tick, which may be shorter or
+        # longer than a model period; a gap of several periods means the
+        # previous reading held throughout it
+        period = self.predictor.period
+        if self.last_time is None:
+            self.last_time = t
+        else:
+            steps = int((t - self.last_time) / period + 0.5)
+            if steps < 1:
+                self.held = (temp, load, freq, duty)
+                return
+            for _ in range(min(steps, int(self.horizon / period)) - 1):
+                self.predictor.observe(*self.held)
+            self.last_time += steps * period
+        self.predictor.observe(temp, load, freq, duty)
+        self.held = (temp, load, freq, duty)
+
+    def __call__(self, temp, duty=None, **inputs):
+        load = inputs.get("load") or 0.0
+        self.observe(self.now(), temp, load, inputs.get("freq") or 0.0, duty or 0.0)
+        self.predicted = None
+        if self.predictor.ready():
+            self.predicted = self.predictor.forecast(self.horizon)
+            temp = max(temp, self.predicted)
+        return self.base(temp=temp, **inputs)
+
+
+def load_predictive(config, base, now=time.monotonic):
+    # PredictivePolicy around `base` from the [Predict] section, e.g.
+    #   [Settings]
+    #   ControlMode = predictive
+    #   [Predict]
+    #   Horizon = 60
+    section = config["Predict"] if config.has_section("Predict") else {}
+    value = lambda key: float(section.get(key, DEFAULTS[key]))
+    predictor = ThermalPredictor(value("Period"), value("Window"), value("Forgetting"),
+                                 int(value("Warmup")))
+    return PredictivePolicy(base, predictor, value("Horizon"), now)
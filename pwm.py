@@ -1,35 +1,148 @@
-import RPi.GPIO as GPIO
 import tkinter as tk
 from tkinter import ttk
-import subprocess
 import time
-import configparser
+import queue
+import socket
 import atexit
 import logging
+import threading
+from collections import namedtuple
+
+from settings import ConfigStore
+from ipc import FanClient, SOCKET_PATH
+from sensors import describe_throttle
+
+# One daemon sample, as shown by the GUI
+Snapshot = namedtuple("Snapshot", "temp freq duty rpm fault throttled")
+
+
+class FanWorker(threading.Thread):
+    # Follows the daemon's telemetry feed off the Tk thread and posts each
+    # sample to `snapshots` as an immutable Snapshot, or None while the
+    # daemon can't be reached; the GUI only reads those. daemon.py owns the
+    # fan, so the slider becomes an override held on a command connection
+    # of our own and ends when the GUI exits. set_manual() only records the
+    # duty and sets an event; a second thread sends it, reconnecting and
+    # sending again when the daemon has restarted.
+    def __init__(self, path=SOCKET_PATH, retry=2.0):
+        super().__init__(name="fan-worker", daemon=True)
+        self.path = path
+        self.retry = retry
+        self.manual_duty = 0.0
+        self.snapshots = queue.Queue()
+        self.stopping = threading.Event()
+        self.override_posted = threading.Event()
+        self.sender = threading.Thread(target=self.send_overrides, name="fan-override", daemon=True)
+        self.feed = None
+        self.command = None
+
+    def start(self):
+        super().start()
+        self.sender.start()
+
+    def run(self):
+        while not self.stopping.is_set():
+            try:
+                self.feed = FanClient(self.path)
+                # A new feed may mean a new daemon, which has no override
+                self.override_posted.set()
+                for state in self.feed.subscribe():
+                    self.snapshots.put(Snapshot(state["temp"], state["freq"], state["duty"],
+                                                state.get("rpm"), state.get("fault"),
+                                                state.get("throttled", 0)))
+            except (OSError, ValueError) as e:
+                if not self.stopping.is_set():
+                    logging.info(f"Fan daemon unavailable: {e}")
+            self.snapshots.put(None)
+            self.stopping.wait(self.retry)
+
+    def send_overrides(self):
+        while True:
+            self.override_posted.wait()
+            if self.stopping.is_set():
+                return
+            self.override_posted.clear()
+            if not self.apply_override():
+                self.stopping.wait(self.retry)
+                self.override_posted.set()
+
+    def apply_override(self):
+        # If the fan speed slider is manually set, use the manual setting;
+        # otherwise let the daemon follow its fan curve. A send on a dead
+        # connection reconnects and sends again; False if that failed too.
+        duty_cycle = self.manual_duty if self.manual_duty > 0 else None
+        for attempt in range(2):
+            try:
+                if self.command is None:
+                    self.command = FanClient(self.path, timeout=1.0)
+                self.command.set_override(duty_cycle)
+                return True
+            except OSError:
+                self.close_command()
+            except ValueError as e:
+                logging.info(f"Fan override refused: {e}")
+                return True
+        return False
+
+    def close_command(self):
+        if self.command is not None:
+            try:
+                self.command.close()
+            except OSError:
+                pass
+            self.command = None
+
+    def set_manual(self, duty_cycle):
+        self.manual_duty = duty_cycle
+        self.override_posted.set()
+
+    def stop(self):
+        self.stopping.set()
+        self.override_posted.set()
+        for client in (self.feed, self.command):
+            if client is not None:
+                try:
+                    client.sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        if self.is_alive():
+            self.join()
+        if self.sender.is_alive():
+            self.sender.join()
+        self.close_command()
+
+
+def describe_fan(snapshot):
+    # What the tach measured when the fan has one, else what was commanded
+    if snapshot.fault in ("stalled", "degraded"):
+        return f"{snapshot.fault.upper()} ({snapshot.rpm:.0f} RPM)"
+    if snapshot.rpm is not None:
+        return f"ON ({snapshot.rpm:.0f} RPM)" if snapshot.rpm > 0 else "OFF"
+    return "ON" if snapshot.duty > 0 else "OFF"
+
 
 class PWMFanControl:
-    def __init__(self, master):
+    def __init__(self, master, socket_path=SOCKET_PATH):
         self.master = master
         master.title("PWM Fan Control")
 
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setwarnings(False)
-
-        self.config = configparser.ConfigParser()
         self.load_settings()  # Load settings from pwm.config
 
-        self.fan_pin_var = tk.StringVar(value=str(self.config.getint('Settings', 'FanPin')))
+        self.fan_pin_var = tk.StringVar(value=str(self.store.settings.fan_pin))
         self.fan_pin_label = tk.Label(self.master, text="Fan GPIO Pin:")
         self.fan_pin_label.grid(row=0, column=0, padx=10, pady=10)
         self.fan_pin_entry = tk.Entry(self.master, textvariable=self.fan_pin_var)
         self.fan_pin_entry.grid(row=0, column=1, padx=10, pady=10)
 
-        self.fan_pwm_pin = self.config.getint('Settings', 'FanPin')
-        GPIO.setup(self.fan_pwm_pin, GPIO.OUT)
-        self.fan_pwm = GPIO.PWM(self.fan_pwm_pin, 100)
-        self.fan_pwm.start(0)
         self.fan_status = tk.StringVar(value="OFF")
 
+        # daemon.py drives the fan on FanPin; we only talk to it
+        self.worker = FanWorker(socket_path)
+        self.worker.manual_duty = self.store.settings.fan_speed
+
+        # Text last shown by each label, so unchanged ones aren't reconfigured
+        self.shown = {}
+
         self.theme_var = tk.StringVar(value="Light")
         self.auto_start_var = tk.BooleanVar(value=True)
 
@@ -47,7 +160,7 @@ class PWMFanControl:
 
         self.pwm_scale = tk.Scale(self.master, from_=0, to=100, orient=tk.HORIZONTAL, length=200, label="",
                                   command=self.update_pwm)
-        self.pwm_scale.set(self.config.getfloat('Settings', 'FanSpeed'))
+        self.pwm_scale.set(self.store.settings.fan_speed)
         self.pwm_scale.grid(row=1, column=1, padx=10, pady=10)
 
         self.temp_label = tk.Label(self.master, text="CPU Temp:")
@@ -78,41 +191,55 @@ class PWMFanControl:
 
         self.start_time = time.time()
 
+        self.worker.start()
         self.update_gui()
+        self.poll_snapshots()
 
     def update_pwm(self, duty_cycle):
         duty_cycle = float(duty_cycle)
-        self.fan_pwm.ChangeDutyCycle(duty_cycle)
-        self.config.set('Settings', 'FanSpeed', str(duty_cycle))
-        self.save_settings()  # Save settings to pwm.config
-        logging.info(f"Fan speed set to {duty_cycle}%")
+        self.worker.set_manual(duty_cycle)
+        self.store.set('Settings', 'FanSpeed', duty_cycle)
+        self.save_settings()  # Save settings to pwm.config once the slider settles
+
+    def set_text(self, widget, text):
+        if self.shown.get(widget) != text:
+            widget.config(text=text)
+            self.shown[widget] = text
+
+    def poll_snapshots(self):
+        # Show the newest snapshot the worker posted, if any
+        posted = False
+        try:
+            while True:
+                snapshot = self.worker.snapshots.get_nowait()
+                posted = True
+        except queue.Empty:
+            pass
+        if posted:
+            self.show(snapshot)
+        self.master.after(100, self.poll_snapshots)
+
+    def show(self, snapshot):
+        if snapshot is None:
+            status = "NO DAEMON"
+        else:
+            self.set_text(self.temp_label, f"CPU Temp: {snapshot.temp}°C")
+            throttled = f" ({describe_throttle(snapshot.throttled)})" if snapshot.throttled else ""
+            self.set_text(self.freq_label, f"CPU Frequency: {snapshot.freq} MHz{throttled}")
+            status = describe_fan(snapshot)
+        if self.fan_status.get() != status:
+            self.fan_status.set(status)
 
     def update_gui(self):
-        temp_str = subprocess.getoutput("vcgencmd measure_temp | sed 's/[^0-9.]//g'")
-        temp = self.parse_temperature(temp_str)
-
-        freq = subprocess.getoutput("vcgencmd measure_clock arm | awk -F '=' '{print $2}'")
-
         elapsed_time = time.time() - self.start_time
         hours, rem = divmod(elapsed_time, 3600)
         minutes, seconds = divmod(rem, 60)
         elapsed_time_str = "{:0>2}:{:0>2}:{:05.2f}".format(int(hours), int(minutes), seconds)
 
-        self.temp_label.config(text=f"CPU Temp: {temp}°C")
-        self.freq_label.config(text=f"CPU Frequency: {int(freq) / 1000000} MHz")
-        self.time_label.config(text=f"Elapsed Time: {elapsed_time_str}")
-
-        self.update_fan_status()
+        self.set_text(self.time_label, f"Elapsed Time: {elapsed_time_str}")
 
         self.master.after(1000, self.update_gui)
 
-    def parse_temperature(self, temp_str):
-        try:
-            return float(temp_str)
-        except ValueError:
-            # logging.warning(f"Failed to convert temperature: {temp_str}")
-            return 0.0
-
     def toggle_theme(self, event=None):
         if self.theme_var.get() == "Dark":
             self.master.configure(bg="#2E2E2E")
@@ -125,52 +252,29 @@ class PWMFanControl:
                 pass  # Some widgets may not support background color
 
     def load_settings(self):
-        try:
-            self.config.read('pwm.config')
-        except FileNotFoundError:
-            # If pwm.config doesn't exist, create it with default settings
-            self.config['Settings'] = {'FanSpeed': '0', 'FanPin': '14', 'ThresholdTemp': '40', 'ThresholdSpeed': '50'}
-            self.save_settings()
+        # Missing settings fall back to defaults. Fan curves live here too;
+        # the daemon reloads them when this file changes.
+        self.store = ConfigStore('pwm.config')
 
     def save_settings(self):
-        self.config.set('Settings', 'FanPin', str(self.fan_pin_var.get()))
-        with open('pwm.config', 'w') as configfile:
-            self.config.write(configfile)
+        # The pin entry may be empty or half typed; only a number is saved
+        try:
+            pin = int(self.fan_pin_var.get())
+        except ValueError:
+            return
+        self.store.set('Settings', 'FanPin', pin)
 
     def cleanup(self):
-        self.fan_pwm.stop()
-        GPIO.cleanup()
+        self.worker.stop()
+        self.store.close()
         self.master.destroy()
 
     def shutdown(self):
-        # This function will be called during system shutdown
-        self.fan_pwm.stop()
-        GPIO.cleanup()
-        logging.info("Fan turned off during system shutdown")
-
-    def update_fan_status(self):
-        current_temp_str = self.temp_label.cget("text").split(":")[1].strip()  # Remove leading/trailing spaces
-        current_temp_str = current_temp_str.replace('°', '')  # Remove '°' symbol
-        current_temp = self.parse_temperature(current_temp_str)
-
-        threshold_temp = self.config.getint('Settings', 'ThresholdTemp')
-        threshold_speed = self.config.getint('Settings', 'ThresholdSpeed')
-
-        if self.pwm_scale.get() > 0:
-            # If the fan speed slider is manually set, use the manual setting
-            self.fan_pwm.ChangeDutyCycle(self.pwm_scale.get())
-        elif current_temp >= threshold_temp:
-            # If the temperature crosses the threshold, set the fan to the threshold speed
-            self.fan_pwm.ChangeDutyCycle(threshold_speed)
-        else:
-            # If the temperature is below the threshold, turn off the fan
-            self.fan_pwm.ChangeDutyCycle(0)
-
-        # Checking if the fan is running (ChangeDutyCycle is not None)
-        if self.fan_pwm.ChangeDutyCycle:
-            self.fan_status.set("ON")
-        else:
-            self.fan_status.set("OFF")
+        # This function will be called during system shutdown. Dropping the
+        # connection hands the fan back to the daemon's automatic control.
+        self.worker.stop()
+        self.store.close()
+        logging.info("Disconnected from the fan daemon")
 
 def main():
     root = tk.Tk()
@@ -0,0 +1,244 @@
+#!/usr/bin/python3
+
+# Offline replay of load profiles through the fan control policies against
+# the thermal model in thermal.py, for judging a change to a curve, the PID
+# gains or the output stage without a Pi and a day of waiting:
+#   python3 replay.py suite                        every standard profile
+#   python3 replay.py run bursty --fan 0.3 0.5 --ambient 25 35
+#   python3 replay.py run fan_telemetry.bin        load recorded by daemon.py
+#   python3 replay.py run step --config pwm.config new.config --mode curve
+# Every combination of --config, --mode and the plant options is one
+# parameter set. All sets replay together: the plants step as one
+# ThermalBank, and each set's policy and output stage see exactly what
+# daemon.py would feed them at its sample interval.
+
+import os
+import sys
+import time
+import random
+import argparse
+import itertools
+import collections
+import configparser
+
+from backends import OutputStage, SimulatedBackend
+from channels import build_policy, output_settings
+from clock import SimulatedClock
+from thermal import ThermalBank, ThermalModel
+
+# A 5 V, 200 mA case fan at full speed; fan power goes as duty³
+FAN_WATTS = 1.0
+
+# Time at or above this counts against a policy: the Pi 3B+ soft limit,
+# where the firmware starts pulling the clock down
+LIMIT = 60.0
+
+MODES = ("curve", "pid", "predictive")
+
+# Plant options, each a ThermalModel parameter that can be swept
+PLANT_OPTIONS = {"ambient": "°C", "fan": "W/K at 100 % duty", "max_power": "W at 100 % load"}
+
+ParameterSet = collections.namedtuple("ParameterSet", "label config mode plant")
+Result = collections.namedtuple("Result", "peak mean above changes energy duty")
+
+
+def bursty_load(seconds, seed=1):
+    # A recorded-looking load trace at 1 Hz: idle spells broken by bursts of
+    # work of random length and intensity
+    rng = random.Random(seed)
+    loads = []
+    while len(loads) < seconds:
+        loads += [rng.uniform(2, 10)] * rng.randint(60, 600)
+        loads += [rng.uniform(60, 100)] * rng.randint(20, 300)
+    return loads[:int(seconds)]
+
+
+def square(seconds, period, busy, high=100.0, low=5.0):
+    # `high` for the first `busy` seconds of every `period`, `low` after
+    return [high if t % period < busy else low for t in range(int(seconds))]
+
+
+# Standard load profiles at 1 Hz: name -> (loads for a length in seconds,
+# description)
+PROFILES = {
+    "idle": (lambda s: [5.0] * int(s), "5 % throughout"),
+    "steady": (lambda s: [50.0] * int(s), "50 % throughout"),
+    "full": (lambda s: [100.0] * int(s), "100 % throughout"),
+    "step": (lambda s: square(s, s, s / 6, high=5.0, low=100.0), "5 % for a sixth of the run, then 100 %"),
+    "busy-idle": (lambda s: square(s, 1200, 600), "100 % and 5 % by turns, 10 minutes each"),
+    "spikes": (lambda s: square(s, 300, 30), "5 % with 30 s at 100 % every 5 minutes"),
+    "ramp": (lambda s: [100.0 * t / s for t in range(int(s))], "0 % rising to 100 %"),
+    "bursty": (bursty_load, "random bursts of 60-100 % between idle spells"),
+}
+
+
+def profile_loads(name, seconds):
+    return PROFILES[name][0](seconds)
+
+
+def trace_loads(path):
+    # Load (%) and frequency (MHz) per sample from a daemon.py telemetry log,
+    # which records one sample per tick
+    from telemetry import TelemetryReader
+
+    reader = TelemetryReader(path)
+    try:
+        samples = list(reader.samples())
+    finally:
+        reader.close()
+    if len(samples) < 2:
+        raise ValueError(f"{path} holds fewer than two samples")
+    period = (samples[-1][0] - samples[0][0]) / (len(samples) - 1)
+    return [s[3] for s in samples], [s[2] for s in samples], period
+
+
+def parameter_sets(configs, modes, plants):
+    # Every combination of a config path, a mode and a plant option value.
+    # `plants` maps option names to lists of values; the label names only
+    # what varies.
+    sets = []
+    names = list(plants)
+    for path, mode, values in itertools.product(configs, modes, itertools.product(*plants.values())):
+        plant = dict(zip(names, values))
+        label = [os.path.basename(path)] if len(configs) > 1 else []
+        label += [mode] if len(modes) > 1 or not label else []
+        label += [f"{name}={value:g}" for name, value in plant.items() if len(plants[name]) > 1]
+        sets.append(ParameterSet(" ".join(label), path, mode, plant))
+    return sets
+
+
+def read_config(path):
+    config = configparser.ConfigParser()
+    config.read(path)
+    return config
+
+
+def replay(sets, loads, freqs=None, period=1.0, limit=LIMIT):
+    # Replay `loads` (% at each tick, `period` seconds apart) through every
+    # parameter set and return a Result for each. Per tick, like daemon.py:
+    # read the temperature to 0.1 °C, run the policy if its inputs changed
+    # or it keeps time, step the output stage when the target changes or a
+    # ramp step is due.
+    # Ramp steps due within a tick take effect for the whole of it.
+    clock = SimulatedClock()
+    configs = {path: read_config(path) for path in {s.config for s in sets}}
+    bank = ThermalBank([ThermalModel(**s.plant) for s in sets])
+
+    policies, outputs, timed = [], [], []
+    for s in sets:
+        config = configs[s.config]
+        policy = build_policy(config, s.mode)
+        timed.append(hasattr(policy, "now"))
+        if timed[-1]:
+            policy.now = clock.now
+        settings = output_settings(config)
+        fan = SimulatedBackend(clock)
+        output = OutputStage(fan, settings["Resolution"], settings["SlewRate"], settings["Dwell"])
+        output.setup(policy(temp=round(bank.temperatures()[len(policies)], 1), duty=0))
+        policies.append(policy)
+        outputs.append(output)
+
+    n = len(sets)
+    readings = [None] * n
+    targets = [None] * n
+    due = [None] * n
+    peak = [float("-inf")] * n
+    total = [0.0] * n
+    above = [0] * n
+    energy = [0.0] * n
+    duty_time = [0.0] * n
+    duties = [output.duty for output in outputs]
+
+    shared = None
+    for i, load in enumerate(loads):
+        t = i * period
+        clock.time = t
+        freq = freqs[i] if freqs is not None else 1500.0
+        # Load and frequency are the same for every set, so a set's inputs
+        # changed if they did or its own reading did
+        changed = (load, freq) != shared
+        shared = (load, freq)
+        temps = bank.temperatures()
+        for j, temp in enumerate(temps):
+            reading = round(temp, 1)
+            output = outputs[j]
+            if changed or reading != readings[j] or timed[j]:
+                readings[j] = reading
+                target = policies[j](temp=reading, freq=freq, load=load, duty=output.duty)
+                if target != targets[j]:
+                    targets[j] = target
+                    due[j] = t
+            if due[j] is not None:
+                while due[j] is not None and due[j] < t + period:
+                    due[j] = output.step(targets[j], max(due[j], t))
+                duties[j] = output.duty
+
+            duty = duties[j]
+            if temp > peak[j]:
+                peak[j] = temp
+            total[j] += temp
+            if temp >= limit:
+                above[j] += 1
+            energy[j] += duty * duty * duty
+            duty_time[j] += duty
+        bank.step(period, load, duties)
+
+    ticks = max(len(loads), 1)
+    return [Result(peak[j], total[j] / ticks, above[j] * period, outputs[j].issued - 1,
+                   energy[j] / 1e6 * FAN_WATTS * period / 3600, duty_time[j] / ticks) for j in range(n)]
+
+
+def print_results(sets, results):
+    width = max([len(s.label) for s in sets] + [len("parameter set")])
+    print(f"{'parameter set':<{width}} {'peak °C':>7} {'mean °C':>7} {'above s':>8} "
+          f"{'changes':>7} {'fan Wh':>7} {'duty %':>6}")
+    for s, r in zip(sets, results):
+        print(f"{s.label:<{width}} {r.peak:7.1f} {r.mean:7.1f} {r.above:8.0f} "
+              f"{r.changes:7d} {r.energy:7.3f} {r.duty:6.1f}")
+
+
+def run_profile(name, sets, loads, freqs, period, limit):
+    start = time.perf_counter()
+    results = replay(sets, loads, freqs, period, limit)
+    elapsed = time.perf_counter() - start
+    simulated = len(loads) * period
+    print(f"\n{name}: {simulated / 3600:.1f} h, {len(sets)} sets in {elapsed:.2f} s "
+          f"({simulated * len(sets) / max(elapsed, 1e-9):,.0f}x real time)")
+    print_results(sets, results)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay load profiles through fan policies on a thermal model")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run = sub.add_parser("run", help="replay one profile or a telemetry log")
+    run.add_argument("profile", help=f"one of {', '.join(PROFILES)}, or a telemetry log")
+    suite = sub.add_parser("suite", help="replay every standard profile")
+    for p in (run, suite):
+        p.add_argument("--config", nargs="+", default=["pwm.config"], help="pwm.config files to compare")
+        p.add_argument("--mode", nargs="+", default=list(MODES), choices=MODES)
+        p.add_argument("--hours", type=float, default=1.0, help="length of a standard profile")
+        p.add_argument("--limit", type=float, default=LIMIT, help="temperature counted against a policy")
+        for name, unit in PLANT_OPTIONS.items():
+            p.add_argument(f"--{name.replace('_', '-')}", dest=name, type=float, nargs="+",
+                           default=[ThermalModel().__dict__[name]], help=unit)
+    args = parser.parse_args()
+
+    sets = parameter_sets(args.config, args.mode, {name: getattr(args, name) for name in PLANT_OPTIONS})
+    if args.command == "suite":
+        print(f"limit {args.limit:.1f} °C; profiles:")
+        for name, (_, description) in PROFILES.items():
+            print(f"  {name:<10} {description}")
+        for name in PROFILES:
+            run_profile(name, sets, profile_loads(name, args.hours * 3600), None, 1.0, args.limit)
+    elif args.profile in PROFILES:
+        run_profile(args.profile, sets, profile_loads(args.profile, args.hours * 3600), None, 1.0, args.limit)
+    elif not os.path.exists(args.profile):
+        parser.error(f"no profile or telemetry log named {args.profile}")
+    else:
+        loads, freqs, period = trace_loads(args.profile)
+        run_profile(args.profile, sets, loads, freqs, period, args.limit)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
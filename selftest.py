@@ -0,0 +1,92 @@
+#!/usr/bin/python3
+
+import os
+import json
+import time
+import asyncio
+import logging
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+CACHE_PATH = "fan_selftest.json"
+
+# A passed test is trusted for this long before it runs again
+MAX_AGE = 7 * 24 * 3600.0
+
+# Seconds at full duty: long enough to spin up and fill the tach window
+SPIN_TIME = 3.0
+
+
+def fan_key(channel):
+    # Identifies the fan hardware, so rewiring a channel retests it
+    fan = channel.fan
+    where = [str(getattr(fan, attr)) for attr in ("pin", "chip_dir", "channel") if hasattr(fan, attr)]
+    return ":".join([channel.name, type(fan).__name__] + where)
+
+
+class SelfTestCache:
+    # Last self-test result per fan, kept in a small JSON file:
+    #   {"fan:RPiGPIOBackend:14": {"time": ..., "passed": true, "rpm": 4890}}
+    def __init__(self, path=CACHE_PATH, wall_time=time.time):
+        self.path = path
+        self.wall_time = wall_time
+        try:
+            with open(path) as f:
+                self.results = json.load(f)
+        except (OSError, ValueError):
+            self.results = {}
+
+    def due(self, channel, max_age=MAX_AGE):
+        # Only a fan with a tach can be verified. It is retested when it has
+        # no passed result or the last pass is older than `max_age`.
+        if channel.tach is None:
+            return False
+        result = self.results.get(fan_key(channel))
+        return (result is None or not result["passed"]
+                or self.wall_time() - result["time"] > max_age)
+
+    def record(self, channel, passed, rpm):
+        self.results[fan_key(channel)] = {"time": self.wall_time(), "passed": passed, "rpm": rpm}
+
+    def save(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".selftest")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.results, f, indent=1)
+        os.replace(tmp, self.path)
+
+
+async def self_test(channels, spin=SPIN_TIME):
+    # Runs `channels` at full duty together for `spin` seconds and checks
+    # each tach reads at least the monitor's degraded fraction of the RPM
+    # expected at 100 %. Returns {name: (passed, rpm)}; passed is None for a
+    # fan without a tach, which only gets the spin.
+    logger.info(f"Fan self-test: 100% for {spin:.0f} seconds")
+    for channel in channels:
+        channel.output.set_duty(100)
+
+    # Start the tach window once the fans are up to speed
+    window = max((getattr(c.tach, "window", 0.0) for c in channels if c.tach), default=0.0)
+    settle = max(spin - window, 0.0)
+    await asyncio.sleep(settle)
+    for channel in channels:
+        if channel.tach is not None:
+            channel.tach.rpm()
+    await asyncio.sleep(spin - settle)
+
+    results = {}
+    for channel in channels:
+        if channel.tach is None:
+            results[channel.name] = (None, None)
+            continue
+        rpm = channel.tach.rpm()
+        expected = channel.monitor.model.expected(100)
+        passed = rpm is not None and rpm >= channel.monitor.degraded * expected
+        results[channel.name] = (passed, rpm)
+        if passed:
+            logger.info(f"Fan {channel.name} self-test passed: {rpm:.0f} RPM at 100%")
+        else:
+            logger.warning(f"Fan failure detected! Fan {channel.name} self-test read "
+                           f"{rpm or 0:.0f} RPM at 100%, expected {expected:.0f}. Check the fan.")
+    return results
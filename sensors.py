@@ -0,0 +1,236 @@
+#!/usr/bin/python3
+
+import os
+import glob
+import time
+import shutil
+import subprocess
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Thermal zone types that belong to the SoC, in order of preference
+CPU_ZONE_TYPES = ("cpu-thermal", "cpu_thermal", "soc_thermal", "x86_pkg_temp")
+
+# Live bits of the firmware's get_throttled word (the same bits shifted up by
+# 16 say it has happened since boot)
+UNDER_VOLTAGE = 0x1
+FREQ_CAPPED = 0x2
+THROTTLED = 0x4
+SOFT_TEMP_LIMIT = 0x8
+THROTTLE_BITS = UNDER_VOLTAGE | FREQ_CAPPED | THROTTLED | SOFT_TEMP_LIMIT
+THROTTLE_NAMES = {UNDER_VOLTAGE: "under-voltage", FREQ_CAPPED: "frequency capped",
+                  THROTTLED: "throttled", SOFT_TEMP_LIMIT: "soft temperature limit"}
+
+# Cooling device types of the cpufreq cooling driver, which pulls
+# scaling_max_freq down when a thermal zone trips ("thermal-cpufreq-0"
+# before Linux 5.8)
+CPUFREQ_COOLING_TYPES = ("cpufreq-", "thermal-cpufreq-")
+
+# The Pi firmware driver's get_throttled attribute (hex), under a platform
+# node whose name varies by model
+GET_THROTTLED = "sys/devices/platform/soc*/soc*:firmware/get_throttled"
+
+# vcgencmd get_throttled forks a process, so without the sysfs attribute an
+# answer is reused for this many seconds
+THROTTLE_CACHE = 5.0
+
+
+class SysfsAttribute:
+    # A sysfs attribute that stays open and is re-read with pread, so a sample
+    # costs one syscall instead of open/read/close (or a fork of vcgencmd)
+    def __init__(self, path, base=10):
+        self.path = path
+        self.base = base
+        self.fd = os.open(path, os.O_RDONLY)
+
+    def read(self):
+        return int(os.pread(self.fd, 32, 0), self.base)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def open_attribute(path, base=10):
+    try:
+        return SysfsAttribute(path, base)
+    except OSError:
+        return None
+
+
+def read_attribute(path, base=10):
+    # One read of an attribute that doesn't change, None if it's missing
+    attr = open_attribute(path, base)
+    if attr is None:
+        return None
+    try:
+        return attr.read()
+    finally:
+        attr.close()
+
+
+def find_thermal_zone(root="/"):
+    # Prefer the zone whose type names the SoC, otherwise the first one found
+    zones = sorted(glob.glob(os.path.join(root, "sys/class/thermal/thermal_zone*")))
+    for zone in zones:
+        try:
+            with open(os.path.join(zone, "type")) as f:
+                if f.read().strip() in CPU_ZONE_TYPES:
+                    return os.path.join(zone, "temp")
+        except OSError:
+            continue
+    for zone in zones:
+        if os.path.exists(os.path.join(zone, "temp")):
+            return os.path.join(zone, "temp")
+    return None
+
+
+def find_cpufreq_cooling(root="/"):
+    # cur_state attributes of the cpufreq cooling devices; a state above 0
+    # means the device is holding the clock down
+    paths = []
+    for device in sorted(glob.glob(os.path.join(root, "sys/class/thermal/cooling_device*"))):
+        try:
+            with open(os.path.join(device, "type")) as f:
+                if f.read().strip().startswith(CPUFREQ_COOLING_TYPES):
+                    paths.append(os.path.join(device, "cur_state"))
+        except OSError:
+            continue
+    return paths
+
+
+def find_temperature(name, root="/"):
+    # Temperature attribute for a zone named in pwm.config: a thermal zone
+    # type ("cpu-thermal"), a hwmon device name ("nvme", "rp1_adc") or a
+    # path to a millidegree attribute
+    if os.path.isabs(name):
+        return os.path.join(root, name.lstrip("/"))
+    for zone in sorted(glob.glob(os.path.join(root, "sys/class/thermal/thermal_zone*"))):
+        try:
+            with open(os.path.join(zone, "type")) as f:
+                if f.read().strip() == name:
+                    return os.path.join(zone, "temp")
+        except OSError:
+            continue
+    hwmon = find_hwmon(name, root)
+    if hwmon is not None:
+        return os.path.join(hwmon, "temp1_input")
+    raise ValueError(f"No temperature sensor named {name}")
+
+
+def find_hwmon(name, root="/"):
+    # Directory of the hwmon device called `name`, or None
+    for hwmon in sorted(glob.glob(os.path.join(root, "sys/class/hwmon/hwmon*"))):
+        try:
+            with open(os.path.join(hwmon, "name")) as f:
+                if f.read().strip() == name:
+                    return hwmon
+        except OSError:
+            continue
+    return None
+
+
+def vcgencmd_temperature():
+    # "temp=45.2'C" -> 45.2
+    out = subprocess.getoutput("vcgencmd measure_temp")
+    return float(out.partition("=")[2].rstrip("'C\n"))
+
+
+def vcgencmd_frequency():
+    # "frequency(48)=1500398464" -> 1500398464
+    out = subprocess.getoutput("vcgencmd measure_clock arm")
+    return int(out.partition("=")[2])
+
+
+def vcgencmd_throttled():
+    # "throttled=0x50005" -> 0x50005
+    out = subprocess.getoutput("vcgencmd get_throttled")
+    return int(out.partition("=")[2], 16)
+
+
+def describe_throttle(bits):
+    return ", ".join(name for bit, name in THROTTLE_NAMES.items() if bits & bit) or "none"
+
+
+class CPUSensors:
+    def __init__(self, root="/", cpu=0, now=time.monotonic):
+        self.root = root
+        self.now = now
+
+        temp_path = find_thermal_zone(root)
+        self.temp_attr = open_attribute(temp_path) if temp_path else None
+        cpufreq = os.path.join(root, f"sys/devices/system/cpu/cpu{cpu}/cpufreq")
+        self.freq_attr = open_attribute(os.path.join(cpufreq, "scaling_cur_freq"))
+
+        if self.temp_attr is None:
+            logger.info("No thermal zone in sysfs, falling back to vcgencmd for temperature")
+        if self.freq_attr is None:
+            logger.info("No cpufreq in sysfs, falling back to vcgencmd for frequency")
+
+        throttle_paths = sorted(glob.glob(os.path.join(root, GET_THROTTLED)))
+        self.throttle_attr = open_attribute(throttle_paths[0], 16) if throttle_paths else None
+        self.vcgencmd = self.throttle_attr is None and shutil.which("vcgencmd") is not None
+        self.throttle_bits = 0
+        self.throttle_time = None
+        # The frequency is capped while cpufreq's limit is below the
+        # hardware maximum and a cpufreq cooling device is active. A limit
+        # set by hand (cpupower frequency-set -u) leaves the cooling devices
+        # at 0 and isn't a thermal cap.
+        self.max_freq_attr = open_attribute(os.path.join(cpufreq, "scaling_max_freq"))
+        self.max_freq = read_attribute(os.path.join(cpufreq, "cpuinfo_max_freq"))
+        self.cooling_attrs = [a for a in map(open_attribute, find_cpufreq_cooling(root)) if a is not None]
+
+    def temperature(self):
+        # CPU temperature in °C (sysfs reports millidegrees)
+        if self.temp_attr is not None:
+            return self.temp_attr.read() / 1000.0
+        return vcgencmd_temperature()
+
+    def frequency(self):
+        # Current ARM clock in Hz (sysfs reports kHz)
+        if self.freq_attr is not None:
+            return self.freq_attr.read() * 1000
+        return vcgencmd_frequency()
+
+    def throttled(self):
+        # Live get_throttled bits, from sysfs or from vcgencmd at most once
+        # per THROTTLE_CACHE seconds, with FREQ_CAPPED added while cpufreq's
+        # limit is below cpuinfo_max_freq through a cpufreq cooling device.
+        # 0 where neither is available.
+        bits = 0
+        if self.throttle_attr is not None:
+            bits = self.throttle_attr.read()
+        elif self.vcgencmd:
+            t = self.now()
+            if self.throttle_time is None or t - self.throttle_time >= THROTTLE_CACHE:
+                self.throttle_time = t
+                try:
+                    self.throttle_bits = vcgencmd_throttled()
+                except ValueError:
+                    logger.info("vcgencmd get_throttled gave no answer, not checking for throttling")
+                    self.vcgencmd = False
+            bits = self.throttle_bits
+        if self.max_freq_attr is not None and self.max_freq is not None and self.cooling_attrs:
+            if self.max_freq_attr.read() < self.max_freq and any(a.read() > 0 for a in self.cooling_attrs):
+                bits |= FREQ_CAPPED
+        return bits & THROTTLE_BITS
+
+    def close(self):
+        for attr in [self.temp_attr, self.freq_attr, self.throttle_attr, self.max_freq_attr] + self.cooling_attrs:
+            if attr is not None:
+                attr.close()
+
+
+class ZoneSensor:
+    # Temperature of one thermal zone other than the SoC (NVMe, PMIC, ...)
+    def __init__(self, name, root="/"):
+        self.name = name
+        self.attr = SysfsAttribute(find_temperature(name, root))
+
+    def temperature(self):
+        return self.attr.read() / 1000.0
+
+    def close(self):
+        self.attr.close()
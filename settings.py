@@ -0,0 +1,201 @@
+#!/usr/bin/python3
+
+import os
+import struct
+import select
+import logging
+import tempfile
+import threading
+import configparser
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {'FanSpeed': '0', 'FanPin': '14', 'ControlMode': 'curve'}
+
+
+@dataclass(frozen=True)
+class Settings:
+    # The [Settings] section, parsed once per load instead of per tick
+    fan_speed: float
+    fan_pin: int
+    control_mode: str
+
+    @classmethod
+    def from_config(cls, config):
+        section = config['Settings']
+        return cls(fan_speed=section.getfloat('FanSpeed'),
+                   fan_pin=section.getint('FanPin'),
+                   control_mode=section.get('ControlMode').lower())
+
+
+class ConfigStore:
+    # pwm.config shared by the daemon and the GUI. Reads parse into a cached
+    # Settings; set() only touches memory and a write is committed once no
+    # change has come in for `debounce` seconds, atomically (temp file +
+    # rename) and merged over any edit another process made meanwhile. With
+    # watch(), external edits are reloaded as inotify reports them.
+    def __init__(self, path='pwm.config', debounce=1.0):
+        self.path = os.path.abspath(path)
+        self.debounce = debounce
+        self.lock = threading.RLock()
+        self.pending = {}
+        self.timer = None
+        self.watcher = None
+        self.load()
+
+    def load(self):
+        config = configparser.ConfigParser()
+        config['Settings'] = DEFAULTS
+        config.read(self.path)
+        with self.lock:
+            self.config = config
+            self.settings = Settings.from_config(config)
+            self.stamp = file_stamp(self.path)
+            # Keep changes we haven't written yet
+            for (section, key), value in self.pending.items():
+                self.apply(section, key, value)
+
+    def apply(self, section, key, value):
+        # A [Settings] value is parsed on a copy first, so a bad one raises
+        # ValueError before it reaches the config or the file
+        if section == 'Settings':
+            trial = configparser.ConfigParser()
+            trial['Settings'] = {**self.config['Settings'], self.config.optionxform(key): value}
+            settings = Settings.from_config(trial)
+        if not self.config.has_section(section):
+            self.config.add_section(section)
+        self.config.set(section, key, value)
+        if section == 'Settings':
+            self.settings = settings
+
+    def set(self, section, key, value):
+        with self.lock:
+            value = str(value)
+            if self.config.get(section, key, fallback=None) == value:
+                return
+            self.apply(section, key, value)
+            self.pending[(section, key)] = value
+            if self.timer is not None:
+                self.timer.cancel()
+            self.timer = threading.Timer(self.debounce, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if not self.pending:
+                return
+            if file_stamp(self.path) != self.stamp:
+                self.load()  # someone else wrote; merge our changes over theirs
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.path), prefix='.pwm.config.')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    self.config.write(f)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp, self.path)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+            self.pending.clear()
+            self.stamp = file_stamp(self.path)
+
+    def watch(self, callback):
+        # Reload and call callback(store) from a background thread whenever
+        # another process replaces or rewrites the file
+        try:
+            self.watcher = Inotify(self.path, self.changed, callback)
+        except OSError as e:
+            logger.info(f"Not watching {self.path} for changes: {e}")
+
+    def changed(self, callback):
+        with self.lock:
+            if file_stamp(self.path) == self.stamp:
+                return  # our own write
+            self.load()
+        logger.info(f"Reloaded {self.path}")
+        callback(self)
+
+    def close(self):
+        self.flush()
+        if self.watcher is not None:
+            self.watcher.close()
+            self.watcher = None
+
+
+def file_stamp(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+# inotify(7) constants
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+EVENT = struct.Struct('iIII')
+
+
+class Inotify:
+    # Watches the directory holding `path`, since editors and ConfigStore
+    # itself replace the file rather than writing it in place
+    def __init__(self, path, handler, *args):
+        import ctypes
+        import ctypes.util
+
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError('inotify is not available')
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        directory, self.name = os.path.split(path)
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+        if libc.inotify_add_watch(self.fd, directory.encode(), mask) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), f'inotify_add_watch {directory} failed')
+
+        self.handler = handler
+        self.args = args
+        self.wake_r, self.wake_w = os.pipe()
+        self.thread = threading.Thread(target=self.run, name='config-watch', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        name = self.name.encode()
+        while True:
+            ready, _, _ = select.select([self.fd, self.wake_r], [], [])
+            if self.wake_r in ready:
+                break
+            try:
+                data = os.read(self.fd, 4096)
+            except BlockingIOError:
+                continue
+            hit = False
+            offset = 0
+            while offset < len(data):
+                _, _, _, length = EVENT.unpack_from(data, offset)
+                offset += EVENT.size
+                if data[offset:offset + length].rstrip(b'\0') == name:
+                    hit = True
+                offset += length
+            if hit:
+                try:
+                    self.handler(*self.args)
+                except Exception as e:
+                    logger.info(f"Failed to reload config: {e}")
+        os.close(self.fd)
+        os.close(self.wake_r)
+
+    def close(self):
+        os.write(self.wake_w, b'x')
+        self.thread.join()
+        os.close(self.wake_w)
@@ -0,0 +1,191 @@
+#!/usr/bin/python3
+
+import os
+import time
+import collections
+
+from sensors import SysfsAttribute, find_hwmon
+
+# Defaults for the tach keys of a [Fan:<name>] or [Tach] section
+DEFAULTS = {
+    "PulsesPerRev": 2,     # most PC fans pulse twice a revolution
+    "MaxRPM": 5000.0,      # at 100 % duty
+    "MinRPM": 1000.0,      # at StartDuty
+    "StartDuty": 20.0,     # below this the fan isn't expected to turn
+    "Window": 2.0,         # seconds of pulses averaged per reading
+    "Settle": 5.0,         # seconds after a duty change before judging RPM
+    "Degraded": 0.6,       # fraction of expected RPM
+    "Stalled": 0.1,        # fraction of expected RPM
+}
+
+
+class TachCounter:
+    # Counts tach pulses and turns them into RPM. pulse() runs once per edge
+    # (on the RPi.GPIO callback thread) and does nothing but bump an int:
+    # there is one writer and rpm() only reads, so no lock is needed. rpm()
+    # keeps (time, count) pairs for the last `window` seconds and divides
+    # across them, so the edge rate never sets the cost of a reading.
+    def __init__(self, pulses_per_rev=2, window=2.0, now=time.monotonic):
+        self.pulses_per_rev = pulses_per_rev
+        self.window = window
+        self.now = now
+        self.pulses = 0
+        self.history = collections.deque()
+
+    def pulse(self, channel=None):
+        self.pulses += 1
+
+    def rpm(self):
+        # None until a second reading gives a span to average over
+        t, count = self.now(), self.pulses
+        history = self.history
+        history.append((t, count))
+        while len(history) > 2 and t - history[1][0] >= self.window:
+            history.popleft()
+        t0, count0 = history[0]
+        if t <= t0:
+            return None
+        return (count - count0) / (t - t0) * 60.0 / self.pulses_per_rev
+
+    def close(self):
+        pass
+
+
+class GPIOTach(TachCounter):
+    # Tach wire on a BCM pin (open collector, so pulled up), counted on
+    # falling edges
+    def __init__(self, pin, pulses_per_rev=2, window=2.0, now=time.monotonic):
+        super().__init__(pulses_per_rev, window, now)
+        self.pin = pin
+        self.GPIO = None
+
+    def setup(self):
+        import RPi.GPIO as GPIO
+        self.GPIO = GPIO
+
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setup(self.pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+        GPIO.add_event_detect(self.pin, GPIO.FALLING, callback=self.pulse)
+
+    def close(self):
+        if self.GPIO is not None:
+            self.GPIO.remove_event_detect(self.pin)
+            self.GPIO = None
+
+
+class HwmonTach:
+    # RPM counted by a kernel driver (pwm-fan, the Pi 5 cooling fan, ...)
+    # and read from fanN_input, with no edge interrupts in this process
+    def __init__(self, name, root="/", index=1):
+        hwmon = find_hwmon(name, root)
+        if hwmon is None:
+            raise ValueError(f"No hwmon device named {name}")
+        self.attr = SysfsAttribute(os.path.join(hwmon, f"fan{index}_input"))
+
+    def setup(self):
+        pass
+
+    def rpm(self):
+        return float(self.attr.read())
+
+    def close(self):
+        self.attr.close()
+
+
+class SimulatedTach(TachCounter):
+    # Pulses from a SimulatedBackend fan, spinning at the RPM `model`
+    # expects for its duty times `health` (1 for a good fan, 0 for a stalled
+    # one). Pulses are added for the clock time elapsed at each reading, so
+    # it runs on simulated time; bench.py tach drives pulse() from a thread
+    # to load the counter at real edge rates instead.
+    def __init__(self, fan, model, clock, pulses_per_rev=2, window=2.0):
+        super().__init__(pulses_per_rev, window, clock.now)
+        self.fan = fan
+        self.model = model
+        self.health = 1.0
+        self.last = clock.now()
+        self.fraction = 0.0
+
+    def setup(self):
+        pass
+
+    def rpm(self):
+        t = self.now()
+        speed = self.model.expected(self.fan.duty) * self.health
+        self.fraction += speed / 60.0 * self.pulses_per_rev * (t - self.last)
+        self.last = t
+        whole = int(self.fraction)
+        self.pulses += whole
+        self.fraction -= whole
+        return super().rpm()
+
+
+class FanModel:
+    # RPM expected for a duty cycle: nothing below start_duty, then linear
+    # from min_rpm to max_rpm at 100 %
+    def __init__(self, max_rpm=5000.0, min_rpm=1000.0, start_duty=20.0):
+        self.max_rpm = max_rpm
+        self.min_rpm = min_rpm
+        self.start_duty = start_duty
+
+    def expected(self, duty):
+        if duty < self.start_duty:
+            return 0.0
+        if self.start_duty >= 100.0:
+            return self.max_rpm
+        fraction = (duty - self.start_duty) / (100.0 - self.start_duty)
+        return self.min_rpm + (self.max_rpm - self.min_rpm) * fraction
+
+
+class FanMonitor:
+    # Judges a fan from its measured RPM: "stalled" below `stalled` and
+    # "degraded" below `degraded` times the RPM expected for the commanded
+    # duty, "ok" otherwise. Readings within `settle` seconds of a duty change
+    # (spin-up, plus the averaging window) and duties the fan isn't expected
+    # to turn at leave the last verdict standing.
+    def __init__(self, model, settle=5.0, degraded=0.6, stalled=0.1):
+        self.model = model
+        self.settle = settle
+        self.degraded = degraded
+        self.stalled = stalled
+        self.duty = None
+        self.changed = None
+        self.status = "unknown"
+
+    def check(self, t, duty, rpm):
+        if duty != self.duty:
+            self.duty = duty
+            self.changed = t
+        expected = self.model.expected(duty)
+        if rpm is None or expected <= 0 or t - self.changed < self.settle:
+            return self.status
+        if rpm < self.stalled * expected:
+            self.status = "stalled"
+        elif rpm < self.degraded * expected:
+            self.status = "degraded"
+        else:
+            self.status = "ok"
+        return self.status
+
+
+def load_tach(section, backend="gpio", fan=None, clock=None, root="/"):
+    # (tach, FanMonitor) from a config section, or (None, None) without a
+    # tach. TachPin counts edges on a GPIO pin, Tach names a hwmon device
+    # with a fanN_input; the sim backend always gets a SimulatedTach.
+    #   [Fan:soc]
+    #   Pin = 14
+    #   TachPin = 15
+    #   MaxRPM = 4800
+    value = lambda key: float(section.get(key, DEFAULTS[key]))
+    model = FanModel(value("MaxRPM"), value("MinRPM"), value("StartDuty"))
+    ppr = int(value("PulsesPerRev"))
+    now = clock.now if clock is not None else time.monotonic
+    if backend == "sim" and fan is not None and clock is not None:
+        tach = SimulatedTach(fan, model, clock, ppr, value("Window"))
+    elif "TachPin" in section:
+        tach = GPIOTach(int(section["TachPin"]), ppr, value("Window"), now)
+    elif "Tach" in section:
+        tach = HwmonTach(section["Tach"], root)
+    else:
+        return None, None
+    return tach, FanMonitor(model, value("Settle"), value("Degraded"), value("Stalled"))
@@ -0,0 +1,225 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import mmap
+import time
+import struct
+import argparse
+from array import array
+
+# On-disk layout: a 16-byte header (magic, record count) followed by fixed
+# records of timestamp (float64 seconds since the epoch) and temp (°C),
+# freq (MHz), load (%), duty (%) and throttled (the live get_throttled bits,
+# see sensors.py) as float32. The file is grown in chunks and the count in
+# the header says how much of it holds records.
+MAGIC = b"PWMTLM02"
+HEADER = struct.Struct("<8sQ")
+RECORD = struct.Struct("<dfffff")
+FIELDS = ("time", "temp", "freq", "load", "duty", "throttled")
+GROW = 1 << 16
+
+# Logs from before the throttled field, read as never throttled
+MAGIC_V1 = b"PWMTLM01"
+RECORD_V1 = struct.Struct("<dffff")
+
+
+class TelemetryLog:
+    # Append-only binary log written through a memory map
+    def __init__(self, path):
+        self.path = path
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        size = os.fstat(self.fd).st_size
+        if size >= HEADER.size and os.pread(self.fd, len(MAGIC_V1), 0) == MAGIC_V1:
+            # Keep an old log for reading under another name and start anew
+            os.close(self.fd)
+            os.replace(path, path + ".v1")
+            self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            size = 0
+        if size < HEADER.size:
+            os.ftruncate(self.fd, HEADER.size + GROW)
+            os.pwrite(self.fd, HEADER.pack(MAGIC, 0), 0)
+            size = HEADER.size + GROW
+        self.map = mmap.mmap(self.fd, size)
+        magic, self.count = HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a telemetry log")
+
+    def reserve(self, records):
+        needed = HEADER.size + (self.count + records) * RECORD.size
+        if needed > len(self.map):
+            size = needed + GROW
+            os.ftruncate(self.fd, size)
+            self.map.resize(size)
+
+    def append(self, samples):
+        # `samples` is a flat sequence of records' fields, len % len(FIELDS) == 0
+        n = len(samples) // len(FIELDS)
+        self.reserve(n)
+        offset = HEADER.size + self.count * RECORD.size
+        for i in range(0, len(samples), len(FIELDS)):
+            RECORD.pack_into(self.map, offset, *samples[i:i + len(FIELDS)])
+            offset += RECORD.size
+        self.count += n
+        # Publish the records only once they're written
+        HEADER.pack_into(self.map, 0, MAGIC, self.count)
+
+    def sync(self):
+        self.map.flush()
+
+    def close(self):
+        if self.map is not None:
+            self.map.flush()
+            self.map.close()
+            os.close(self.fd)
+            self.map = None
+
+
+class TelemetryBuffer:
+    # Preallocated ring of the latest `capacity` samples. Every `batch`
+    # samples the ones not yet written go to the log in one append, so the SD
+    # card sees a write per batch instead of a line per tick.
+    def __init__(self, capacity=3600, batch=60, log=None):
+        self.capacity = capacity
+        self.batch = min(batch, capacity)
+        self.log = log
+        self.data = array("d", bytes(8 * len(FIELDS) * capacity))
+        self.total = 0      # samples ever appended
+        self.flushed = 0    # samples written to the log
+
+    def append(self, timestamp, temp, freq, load, duty, throttled=0):
+        i = (self.total % self.capacity) * len(FIELDS)
+        data = self.data
+        data[i] = timestamp
+        data[i + 1] = temp
+        data[i + 2] = freq
+        data[i + 3] = load
+        data[i + 4] = duty
+        data[i + 5] = throttled
+        self.total += 1
+        if self.log is not None and self.total - self.flushed >= self.batch:
+            self.flush()
+
+    def span(self, start, end):
+        # Flat fields of samples [start, end), which must still be in the ring
+        width = len(FIELDS)
+        a = (start % self.capacity) * width
+        b = (end % self.capacity) * width
+        if end - start == 0:
+            return array("d")
+        if a < b:
+            return self.data[a:b]
+        return self.data[a:] + self.data[:b]
+
+    def flush(self):
+        if self.log is None or self.flushed == self.total:
+            return
+        self.log.append(self.span(self.flushed, self.total))
+        self.flushed = self.total
+
+    def latest(self, n=None):
+        # The last `n` samples still in the ring, oldest first, as tuples
+        n = min(n or self.capacity, self.total, self.capacity)
+        flat = self.span(self.total - n, self.total)
+        width = len(FIELDS)
+        return [tuple(flat[i:i + width]) for i in range(0, len(flat), width)]
+
+    def close(self):
+        self.flush()
+        if self.log is not None:
+            self.log.close()
+
+
+class TelemetryReader:
+    # Reads a TelemetryLog through a read-only memory map, so history of any
+    # length is streamed without being loaded
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = HEADER.unpack_from(self.map)
+        if magic not in (MAGIC, MAGIC_V1):
+            raise ValueError(f"{path} is not a telemetry log")
+        self.record = RECORD if magic == MAGIC else RECORD_V1
+
+    def __len__(self):
+        return self.count
+
+    def time_at(self, i):
+        return struct.unpack_from("<d", self.map, HEADER.size + i * self.record.size)[0]
+
+    def index(self, timestamp):
+        # First record at or after `timestamp`; records are in time order
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.time_at(mid) < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def samples(self, start=None, end=None, chunk=4096):
+        # Yield (time, temp, freq, load, duty, throttled) between two
+        # timestamps
+        first = 0 if start is None else self.index(start)
+        last = self.count if end is None else self.index(end)
+        record = self.record
+        for i in range(first, last, chunk):
+            n = min(chunk, last - i)
+            offset = HEADER.size + i * record.size
+            samples = record.iter_unpack(self.map[offset:offset + n * record.size])
+            if record is RECORD:
+                yield from samples
+            else:
+                yield from (sample + (0.0,) for sample in samples)
+
+    def aggregate(self, window, start=None, end=None):
+        # Yield a dict per `window` seconds: sample count, mean of each field
+        # and the peak temperature and duty; "throttled" is the fraction of
+        # samples with any throttle bit set
+        bucket = None
+        for sample in self.samples(start, end):
+            key = sample[0] - sample[0] % window
+            if bucket is None or key != bucket["time"]:
+                if bucket is not None:
+                    yield finish(bucket)
+                bucket = {"time": key, "count": 0, "max_temp": sample[1], "max_duty": sample[4],
+                          "temp": 0.0, "freq": 0.0, "load": 0.0, "duty": 0.0, "throttled": 0.0}
+            bucket["count"] += 1
+            for name, value in zip(FIELDS[1:5], sample[1:5]):
+                bucket[name] += value
+            bucket["throttled"] += sample[5] != 0
+            bucket["max_temp"] = max(bucket["max_temp"], sample[1])
+            bucket["max_duty"] = max(bucket["max_duty"], sample[4])
+        if bucket is not None:
+            yield finish(bucket)
+
+    def close(self):
+        self.map.close()
+
+
+def finish(bucket):
+    for name in FIELDS[1:]:
+        bucket[name] /= bucket["count"]
+    return bucket
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize a binary fan telemetry log")
+    parser.add_argument("path", nargs="?", default="fan_telemetry.bin")
+    parser.add_argument("--window", type=float, default=3600.0, help="seconds per summary row")
+    parser.add_argument("--start", type=float, help="epoch seconds")
+    parser.add_argument("--end", type=float, help="epoch seconds")
+    args = parser.parse_args()
+
+    reader = TelemetryReader(args.path)
+    print(f"{'window start':<20} {'samples':>7} {'temp °C':>8} {'max °C':>7} {'MHz':>6} {'load %':>7} {'duty %':>7} {'throttled %':>11}")
+    for row in reader.aggregate(args.window, args.start, args.end):
+        when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(row["time"]))
+        print(f"{when:<20} {row['count']:7d} {row['temp']:8.1f} {row['max_temp']:7.1f} "
+              f"{row['freq']:6.0f} {row['load']:7.1f} {row['duty']:7.1f} {100 * row['throttled']:11.1f}")
+    reader.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
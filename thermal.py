@@ -0,0 +1,147 @@
+#!/usr/bin/python3
+
+# Lumped thermal model of a Pi SoC with a heatsink and a PWM fan, used to
+# exercise controllers off-Pi. Two nodes: the die heats the heatsink through
+# a fixed resistance, and the heatsink loses heat to ambient through a
+# conductance that grows with fan duty. ThermalBank steps many of them, one
+# per parameter set, in lockstep.
+
+import fancurve
+from sensors import FREQ_CAPPED, SOFT_TEMP_LIMIT
+
+# ThermalModel parameters, in the order ThermalBank keeps them
+PARAMETERS = ("ambient", "idle_power", "max_power", "soc_capacity", "sink_capacity",
+              "soc_to_sink", "passive", "fan")
+
+
+class ThermalModel:
+    def __init__(self, ambient=25.0, idle_power=2.7, max_power=6.4,
+                 soc_capacity=4.0, sink_capacity=40.0, soc_to_sink=2.0,
+                 passive=0.1, fan=0.5, temp=None):
+        self.ambient = ambient
+        self.idle_power = idle_power        # W at 0 % load
+        self.max_power = max_power          # W at 100 % load
+        self.soc_capacity = soc_capacity    # J/K
+        self.sink_capacity = sink_capacity  # J/K
+        self.soc_to_sink = soc_to_sink      # K/W
+        self.passive = passive              # W/K to ambient with the fan off
+        self.fan = fan                      # extra W/K at 100 % duty
+
+        self.soc_temp = ambient if temp is None else temp
+        self.sink_temp = self.soc_temp
+
+    def power(self, load):
+        return self.idle_power + (self.max_power - self.idle_power) * load / 100
+
+    def conductance(self, duty):
+        return self.passive + self.fan * duty / 100
+
+    def step(self, dt, load, duty, max_step=0.5):
+        # Explicit Euler in sub-steps short enough to stay stable
+        while dt > 0:
+            h = min(dt, max_step)
+            to_sink = (self.soc_temp - self.sink_temp) / self.soc_to_sink
+            to_air = (self.sink_temp - self.ambient) * self.conductance(duty)
+            self.soc_temp += h * (self.power(load) - to_sink) / self.soc_capacity
+            self.sink_temp += h * (to_sink - to_air) / self.sink_capacity
+            dt -= h
+        return self.soc_temp
+
+    def steady_state(self, load, duty):
+        power = self.power(load)
+        return self.ambient + power * (self.soc_to_sink + 1 / self.conductance(duty))
+
+
+class ThermalBank:
+    # ThermalModels with any mix of parameters stepped together under one
+    # load. With numpy the parameters and temperatures are arrays and a step
+    # costs the same handful of array operations for one model or a
+    # thousand, in exactly ThermalModel's arithmetic; without numpy it steps
+    # the models one by one. The models are left at their start state.
+    def __init__(self, models):
+        self.models = models
+        self.np = fancurve.numpy()
+        if self.np is not None:
+            for name in PARAMETERS:
+                setattr(self, name, self.np.array([getattr(m, name) for m in models], dtype=float))
+            self.soc = self.np.array([m.soc_temp for m in models], dtype=float)
+            self.sink = self.np.array([m.sink_temp for m in models], dtype=float)
+        else:
+            self.models = [ThermalModel(**{name: getattr(m, name) for name in PARAMETERS},
+                                        temp=m.soc_temp) for m in models]
+
+    def __len__(self):
+        return len(self.models)
+
+    def temperatures(self):
+        if self.np is not None:
+            return self.soc.tolist()
+        return [m.soc_temp for m in self.models]
+
+    def step(self, dt, load, duties, max_step=0.5):
+        # Advance every model `dt` seconds at `load` %, each at its own duty
+        if self.np is None:
+            for model, duty in zip(self.models, duties):
+                model.step(dt, load, duty, max_step)
+            return
+        power = self.idle_power + (self.max_power - self.idle_power) * load / 100
+        conductance = self.passive + self.fan * self.np.asarray(duties, dtype=float) / 100
+        while dt > 0:
+            h = min(dt, max_step)
+            to_sink = (self.soc - self.sink) / self.soc_to_sink
+            to_air = (self.sink - self.ambient) * conductance
+            self.soc = self.soc + h * (power - to_sink) / self.soc_capacity
+            self.sink = self.sink + h * (to_sink - to_air) / self.sink_capacity
+            dt -= h
+
+
+class SimulatedSensors:
+    # Sensors backed by a ThermalModel. Reading the temperature advances the
+    # model to the clock's current time, using the duty cycle the fan backend
+    # holds and the load profile (a function of clock time, in %).
+    # With `soft_limit` (°C) it also stands in for the Pi firmware: from that
+    # temperature until the SoC is `release` °C below it, the clock is
+    # capped to `capped` Hz and throttled() reports it. The load runs slower
+    # and draws power in proportion; `lost` adds up the work not done, in
+    # seconds of one CPU at full clock.
+    def __init__(self, model, fan, clock, load=lambda t: 0.0, frequency=1500000000,
+                 soft_limit=None, capped=1200000000, release=3.0):
+        self.model = model
+        self.fan = fan
+        self.clock = clock
+        self.load_profile = load
+        self.max_freq = self.freq = frequency
+        self.soft_limit = soft_limit
+        self.capped = capped
+        self.release = release
+        self.lost = 0.0
+        self.time = clock.now()
+
+    def advance(self):
+        now = self.clock.now()
+        if now > self.time:
+            load = self.load_profile(self.time)
+            speed = self.freq / self.max_freq
+            self.model.step(now - self.time, load * speed, self.fan.duty)
+            self.lost += load / 100 * (1 - speed) * (now - self.time)
+            self.time = now
+            if self.soft_limit is not None:
+                if self.model.soc_temp >= self.soft_limit:
+                    self.freq = self.capped
+                elif self.model.soc_temp < self.soft_limit - self.release:
+                    self.freq = self.max_freq
+
+    def temperature(self):
+        self.advance()
+        return round(self.model.soc_temp, 1)
+
+    def frequency(self):
+        self.advance()
+        return self.freq
+
+    def throttled(self):
+        self.advance()
+        return SOFT_TEMP_LIMIT | FREQ_CAPPED if self.freq < self.max_freq else 0
+
+    def load(self):
+        return self.load_profile(self.clock.now())